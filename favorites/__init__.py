@@ -0,0 +1 @@
+from favorites.registry import register, unregister
@@ -1,7 +1,116 @@
+import re
+
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import InvalidPage, Paginator
+from django.db import connections
+
+from favorites.models import Folder, Favorite, FavoriteCount, FavoriteBucket, FavoriteEvent, FavoriteVersion
+
+
+#: Row estimates below this number are replaced by an exact count
+ESTIMATE_THRESHOLD = 100000
+
+
+def estimated_count(queryset):
+    """Returns the number of rows of ``queryset``, estimated by the query
+    planner of PostgreSQL or from the table statistics of MySQL when it's
+    large, and counted otherwise. MySQL only estimates unfiltered querysets."""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+        sql = 'EXPLAIN ' + sql
+    elif connection.vendor == 'mysql' and not queryset.query.where:
+        sql = ("SELECT table_rows FROM information_schema.tables "
+               "WHERE table_schema = DATABASE() AND table_name = %s")
+        params = [queryset.model._meta.db_table]
+    else:
+        return queryset.count()
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    estimate = None
+    if row is not None and connection.vendor == 'postgresql':
+        # first line of the plan, e.g. "Seq Scan on ... (cost=... rows=1234 width=...)"
+        match = re.search(r' rows=(\d+)', row[0])
+        estimate = int(match.group(1)) if match else None
+    elif row is not None:
+        estimate = row[0]
+    if estimate is None or estimate < ESTIMATE_THRESHOLD:
+        return queryset.count()
+    return int(estimate)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator counting objects with :func:`favorites.admin.estimated_count`
+    instead of an unbounded ``COUNT(*)``"""
+    def _get_count(self):
+        if self._count is None:
+            self._count = estimated_count(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+
+class FavoriteChangeList(ChangeList):
+    """Estimates the number of favorites without filters instead of counting
+    them, and fetches the favorited objects of the displayed page with one
+    query per content type"""
+    def get_results(self, request):
+        # as ChangeList.get_results, but for full_result_count
+        paginator = self.model_admin.get_paginator(request, self.query_set, self.list_per_page)
+        result_count = paginator.count
+        if not self.query_set.query.where:
+            full_result_count = result_count
+        else:
+            full_result_count = estimated_count(self.root_query_set)
+
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
+
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.query_set._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num + 1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list.prefetch_related('content_object')
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+
+class FolderAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user')
+    list_select_related = True
+    raw_id_fields = ('user',)
+    paginator = EstimatedCountPaginator
+
+
+class FavoriteAdmin(admin.ModelAdmin):
+    list_display = ('__unicode__', 'content_type', 'object_id', 'folder', 'created_on', 'shared')
+    # content type is the leading column of favorites_favorite_content_type_object,
+    # shared favorites are served by the partial indexes of sql/favorite.<backend>.sql
+    list_filter = ('content_type', 'shared')
+    raw_id_fields = ('user', 'folder')
+    paginator = EstimatedCountPaginator
+
+    def queryset(self, request):
+        # list_select_related doesn't follow the nullable folder
+        qs = super(FavoriteAdmin, self).queryset(request)
+        return qs.select_related('user', 'content_type', 'folder')
 
-from favorites.models import Folder, Favorite
+    def get_changelist(self, request, **kwargs):
+        return FavoriteChangeList
 
 
-admin.site.register(Folder)
-admin.site.register(Favorite)
+admin.site.register(Folder, FolderAdmin)
+admin.site.register(Favorite, FavoriteAdmin)
+admin.site.register(FavoriteCount)
+admin.site.register(FavoriteBucket)
+admin.site.register(FavoriteEvent)
+admin.site.register(FavoriteVersion)
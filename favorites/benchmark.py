@@ -0,0 +1,199 @@
+"""Query counts and wall time of favorites views and template tags.
+
+Use the ``benchmark_favorites`` management command to run the benchmark
+on a test database seeded with configurable volumes, or run the
+``favorites.BenchmarkTests`` test case. Query counts are compared against
+the baselines recorded in ``benchmark_baselines.json``: page sizes are
+fixed, so counts must not depend on the seeded volumes.
+"""
+import json
+import os
+import time
+
+from django.contrib.auth.models import User, Group
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.db import connection, reset_queries
+from django.template import Template, Context
+from django.test.client import Client, RequestFactory
+
+from favorites import registry
+from favorites.models import Favorite, Folder
+
+
+#: File where query count baselines are recorded
+BASELINES = os.path.join(os.path.dirname(__file__), 'benchmark_baselines.json')
+#: Number of objects rendered by template tags benchmarks
+OBJECTS_PER_PAGE = 20
+#: Password of seeded users
+PASSWORD = 'benchmark'
+
+
+def seed(users=10, folders=5, favorites=100):
+    """Creates ``users`` users, each one with ``folders`` folders and
+    ``favorites`` favorites spread over three content types (groups, users
+    and folders) and over his or her folders. Favorites without folder are
+    shared.
+
+    :returns: the list of created users.
+    """
+    # favorited objects
+    targets = (favorites + 2) // 3
+    Group.objects.bulk_create([Group(name='benchmark-%s' % i) for i in range(targets)])
+    User.objects.bulk_create([User(username='benchmark-target-%s' % i) for i in range(targets)])
+    owner = User.objects.create(username='benchmark-owner')
+    Folder.objects.bulk_create([Folder(user=owner, name='target-%s' % i) for i in range(targets)])
+    objects = []
+    for group, user, folder in zip(Group.objects.filter(name__startswith='benchmark-'),
+                                   User.objects.filter(username__startswith='benchmark-target-'),
+                                   Folder.objects.filter(user=owner)):
+        objects.extend((group, user, folder))
+    objects = objects[:favorites]
+
+    # users, folders and favorites
+    created = []
+    for i in range(users):
+        user = User(username='benchmark-user-%s' % i)
+        user.set_password(PASSWORD)
+        user.save()
+        Folder.objects.bulk_create([Folder(user=user, name='folder-%s' % j) for j in range(folders)])
+        buckets = [None] + list(Folder.objects.filter(user=user))
+        for j, folder in enumerate(buckets):
+            Favorite.objects.bulk_create_favorites(objects[j::len(buckets)], user, folder)
+        # favorites without folder are shared
+        Favorite.objects.filter(user=user, folder=None).update(shared=True)
+        created.append(user)
+    return created
+
+
+def measure(report, name, func, *args, **kwargs):
+    """Runs ``func`` and records its query count and wall time in ``report``"""
+    reset_queries()
+    start = time.time()
+    func(*args, **kwargs)
+    report[name] = {'queries': len(connection.queries),
+                    'time': time.time() - start}
+
+
+def _render(source, **context):
+    return Template('{% load favorites_tags %}' + source).render(Context(context))
+
+
+def run(user):
+    """Measures every view of ``favorites.urls`` and every template tag of
+    ``favorites_tags`` as ``user``, who should have favorites in folders.
+
+    :returns: a dictionary mapping measure names to ``queries`` and ``time``.
+    """
+    report = {}
+    registry.warm()
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        _run_views(report, user)
+        _run_tags(report, user)
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+    return report
+
+
+def _run_views(report, user):
+    client = Client()
+    client.login(username=user.username, password=PASSWORD)
+    favorite = Favorite.objects.favorites_for_user(user).exclude(folder=None)[0]
+    folder = favorite.folder
+    model = favorite.content_type.model_class()
+    model_kwargs = {'app_label': model._meta.app_label,
+                    'object_name': model._meta.module_name}
+    group = Group.objects.create(name='benchmark-not-favorite')
+    group_kwargs = {'app_label': 'auth', 'object_name': 'group', 'object_id': group.pk}
+    ajax_data = {'content_type_id': ContentType.objects.get_for_model(Group).pk,
+                 'object_id': group.pk}
+
+    def fetch(url):
+        # streamed responses run their queries while being read
+        return client.get(url).content
+
+    def get(name, *args, **kwargs):
+        measure(report, 'view:%s' % name, fetch,
+                reverse('favorites:%s' % name, args=args, kwargs=kwargs))
+
+    def post(name, data, **kwargs):
+        measure(report, 'view:%s' % name, client.post,
+                reverse('favorites:%s' % name, kwargs=kwargs), data)
+
+    get('favorite_list')
+    get('favorite_add', **group_kwargs)
+    get('favorite_delete', favorite.pk)
+    get('favorite_delete_for_object', app_label=model._meta.app_label,
+        object_name=model._meta.module_name, object_id=favorite.object_id)
+    get('favorite_move', favorite.pk)
+    get('favorite_move_to_folder', favorite.pk, folder.pk)
+    get('favorite_toggle_share', favorite.pk)
+    get('favorite_content_type_list', **model_kwargs)
+    get('favorite_content_type_and_folder_list', folder_id=folder.pk, **model_kwargs)
+    get('favorite_export')
+    get('favorite_shared_list')
+    get('favorite_shared_list_for_user', username=user.username)
+    get('folder_list')
+    get('folder_add')
+    get('folder_delete', folder.pk)
+    get('folder_update', folder.pk)
+    post('favorite_ajax_add', ajax_data)
+    post('favorite_ajax_remove', ajax_data)
+    post('favorite_toggle', {}, **ajax_data)
+    Favorite.objects.bulk_remove_favorites([group], user)
+    group.delete()
+
+
+def _run_tags(report, user):
+    objects = list(Group.objects.all()[:OBJECTS_PER_PAGE])
+    favorites = list(Favorite.objects.favorites_for_user(user)[:OBJECTS_PER_PAGE])
+    request = RequestFactory().get('/')
+    request.user = User.objects.get(pk=user.pk)
+
+    def tag(name, source, **context):
+        # a fresh user instance, without memoized favorites
+        context.setdefault('user', User.objects.get(pk=user.pk))
+        context.setdefault('csrf_token', 'benchmark')
+        measure(report, 'tag:%s' % name, _render, source, **context)
+
+    tag('is_favorite', '{% for o in objects %}{{ o|is_favorite:user }}{% endfor %}',
+        objects=objects)
+    tag('add_remove_favorite',
+        '{% favorites_for_objects objects user as favs %}'
+        '{% for o in objects %}{% add_remove_favorite o user favs %}{% endfor %}',
+        objects=objects)
+    tag('favorites_for_objects',
+        '{% favorites_for_objects objects user as favs %}'
+        '{% for o in objects %}{% favorite_entry_for_item o from favs as f %}{% endfor %}',
+        objects=objects)
+    tag('url_add_to_favorites', '{% for o in objects %}{% url_add_to_favorites o %}{% endfor %}',
+        objects=objects)
+    tag('url_delete_from_favorites_confirmation',
+        '{% for o in objects %}{% url_delete_from_favorites_confirmation "favorites" o %}{% endfor %}',
+        objects=objects)
+    tag('favorite_move_widget', '{% for f in favorites %}{% favorite_move_widget f %}{% endfor %}',
+        favorites=favorites, request=request)
+
+
+def load_baselines(path=BASELINES):
+    """Returns the dictionary of query counts recorded in ``path``"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(report, path=BASELINES):
+    """Records query counts of ``report`` as baselines in ``path``"""
+    baselines = dict((name, values['queries']) for name, values in report.items())
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=4, sort_keys=True)
+        f.write('\n')
+
+
+def regressions(report, baselines):
+    """Returns the sorted list of ``(name, queries, baseline)`` for measures
+    of ``report`` running more queries than their baseline"""
+    return sorted((name, values['queries'], baselines[name])
+                  for name, values in report.items()
+                  if name in baselines and values['queries'] > baselines[name])
@@ -0,0 +1,106 @@
+"""Optional cache of the objects favorited by each user.
+
+It is disabled by default, set ``FAVORITES_CACHE`` to the alias of one of
+the ``CACHES`` to enable it. ``FAVORITES_CACHE_TIMEOUT`` overrides the
+timeout of the cache backend, the ``cache_ttl`` of a model registered with
+:func:`favorites.register` overrides both for this model.
+
+For each user and content type, the cache stores the set of favorited
+object ids. Entries are dropped whenever a :class:`favorites.models.Favorite`
+of the user is saved or deleted, once the change is committed.
+
+``FAVORITES_FRAGMENT_CACHE`` enables the cache of the markup rendered by the
+``add_remove_favorite`` template tag, see :func:`fragment_key`.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+from favorites import signals
+
+
+KEY_PREFIX = 'favorites'
+
+
+def get_favorites_cache(setting='FAVORITES_CACHE'):
+    """Returns the cache backend named by ``setting`` or ``None``"""
+    alias = getattr(settings, setting, None)
+    if alias is None:
+        return None
+    return get_cache(alias)
+
+
+def get_fragment_cache():
+    """Returns the cache backend named by ``FAVORITES_FRAGMENT_CACHE`` or ``None``"""
+    return get_favorites_cache('FAVORITES_FRAGMENT_CACHE')
+
+
+def _key(user_id, content_type_id):
+    return '%s:%s:%s' % (KEY_PREFIX, user_id, content_type_id)
+
+
+def get_object_ids(user_id, content_type_id):
+    """Returns the cached set of object ids favorited by a user for a
+    content type, ``None`` if it's not cached."""
+    cache = get_favorites_cache()
+    if cache is None:
+        return None
+    return cache.get(_key(user_id, content_type_id))
+
+
+def set_object_ids(user_id, content_type_id, object_ids, timeout=None):
+    """Caches the set of object ids favorited by a user for a content type.
+    ``timeout`` defaults to ``FAVORITES_CACHE_TIMEOUT``."""
+    cache = get_favorites_cache()
+    if cache is None:
+        return
+    if timeout is None:
+        timeout = getattr(settings, 'FAVORITES_CACHE_TIMEOUT', None)
+    if timeout is None:
+        cache.set(_key(user_id, content_type_id), object_ids)
+    else:
+        cache.set(_key(user_id, content_type_id), object_ids, timeout)
+
+
+def invalidate(user_id, content_type_id):
+    """Drops the cached favorites of a user for a content type, once the
+    change in progress is committed, see :func:`favorites.signals.on_commit`"""
+    cache = get_favorites_cache()
+    if cache is None:
+        return
+    signals.on_commit(lambda: cache.delete(_key(user_id, content_type_id)))
+
+
+def _object_key(content_type_id, object_id):
+    return '%s:object:%s:%s' % (KEY_PREFIX, content_type_id, object_id)
+
+
+def object_version(content_type_id, object_id):
+    """Returns the version of the favorites of an object, which changes
+    whenever it's favorited or unfavorited"""
+    cache = get_fragment_cache()
+    key = _object_key(content_type_id, object_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, repr(time.time()))
+        version = cache.get(key)
+    return version
+
+
+def bump_object_versions(content_type_id, object_ids):
+    """Changes the version of the favorites of objects, dropping their
+    cached fragments, once the change in progress is committed"""
+    cache = get_fragment_cache()
+    if cache is None:
+        return
+    keys = [_object_key(content_type_id, object_id) for object_id in object_ids]
+    signals.on_commit(lambda: cache.delete_many(keys))
+
+
+def fragment_key(content_type_id, object_id, is_favorite):
+    """Returns the key of the ``add_remove_favorite`` fragment of an object,
+    as rendered for a user who did (or didn't) favorite it"""
+    return '%s:fragment:%s:%s:%d:%s' % (KEY_PREFIX, content_type_id, object_id,
+                                        is_favorite,
+                                        object_version(content_type_id, object_id))
@@ -0,0 +1,103 @@
+"""Streaming export of the favorites of a user.
+
+Favorites are read ``chunk_size`` at a time in primary key order with
+``values_list``, without building model instances, and the labels of the
+favorited objects are resolved with one query per content type and chunk,
+so memory is bounded whatever the number of favorites.
+
+Each favorite is exported with the fields of :data:`FIELDS`, the
+``content_type`` being an ``"app_label.model"`` string.
+"""
+import csv
+import json
+import StringIO
+
+from django.contrib.contenttypes.models import ContentType
+
+from favorites.models import Favorite
+
+
+#: Exported fields, in CSV column order
+FIELDS = ('id', 'content_type', 'object_id', 'object', 'folder', 'created_on', 'shared')
+#: Supported formats and their mimetypes
+FORMATS = {'ndjson': 'application/x-ndjson',
+           'csv': 'text/csv'}
+
+
+def iter_favorites(user, chunk_size=1000):
+    """Yields a dictionary of :data:`FIELDS` for each favorite of ``user``"""
+    qs = Favorite.objects.favorites_for_user(user).order_by('pk')
+    qs = qs.values_list('pk', 'content_type', 'object_id', 'folder__name',
+                        'created_on', 'shared')
+    last_pk = 0
+    while True:
+        rows = list(qs.filter(pk__gt=last_pk)[:chunk_size])
+        if not rows:
+            return
+        labels = _labels(rows)
+        for pk, content_type_id, object_id, folder, created_on, shared in rows:
+            content_type = ContentType.objects.get_for_id(content_type_id)
+            yield {'id': pk,
+                   'content_type': '%s.%s' % (content_type.app_label, content_type.model),
+                   'object_id': object_id,
+                   'object': labels.get((content_type_id, object_id)),
+                   'folder': folder,
+                   'created_on': created_on.isoformat(),
+                   'shared': shared}
+        last_pk = rows[-1][0]
+
+
+def _labels(rows):
+    """Returns a dictionary mapping ``(content_type_id, object_id)`` of
+    ``rows`` to the unicode representation of the favorited objects, with
+    one query per content type."""
+    object_ids = {}
+    for _, content_type_id, object_id, _, _, _ in rows:
+        object_ids.setdefault(content_type_id, []).append(object_id)
+    labels = {}
+    for content_type_id, ids in object_ids.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            continue
+        for pk, obj in model._default_manager.in_bulk(ids).items():
+            labels[(content_type_id, pk)] = unicode(obj)
+    return labels
+
+
+def export_ndjson(user, chunk_size=1000):
+    """Yields the favorites of ``user`` as lines of JSON objects"""
+    for favorite in iter_favorites(user, chunk_size):
+        yield json.dumps(favorite) + '\n'
+
+
+def export_csv(user, chunk_size=1000):
+    """Yields the favorites of ``user`` as UTF-8 encoded CSV lines, starting
+    with a header line"""
+    buf = StringIO.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(FIELDS)
+    for favorite in iter_favorites(user, chunk_size):
+        writer.writerow([_encode(favorite[field]) for field in FIELDS])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    # header of an empty export
+    if buf.getvalue():
+        yield buf.getvalue()
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def export(user, format='ndjson', chunk_size=1000):
+    """Yields the favorites of ``user`` in ``format``, one of :data:`FORMATS`"""
+    if format == 'ndjson':
+        return export_ndjson(user, chunk_size)
+    if format == 'csv':
+        return export_csv(user, chunk_size)
+    raise ValueError("Unknown export format %r" % format)
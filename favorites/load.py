@@ -0,0 +1,210 @@
+"""Streaming bulk import of favorites, see the ``load_favorites`` management
+command.
+
+Records are read lazily from NDJSON or CSV files with the fields of
+:data:`favorites.export.FIELDS` plus an optional ``user`` username, so the
+output of an export can be loaded back. ``content_type`` is an
+``"app_label.model"`` string and must name a favoritable model, see
+:mod:`favorites.registry`; ``folder`` is a folder name, created if needed.
+
+Records are loaded ``batch_size`` at a time: users, folders, favorited
+objects and existing favorites are looked up with one query per batch and
+content type, new favorites are inserted with ``bulk_create`` and each batch
+is committed. Favorites that already exist are skipped, so a load can be
+resumed by running it again or by skipping the records already read.
+"""
+import csv
+import itertools
+import json
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.utils.dateparse import parse_datetime
+
+from favorites import cache, registry, signals
+from favorites.models import Favorite, FavoriteCount, FavoriteBucket, FavoriteVersion, Folder
+
+
+def read_ndjson(f):
+    """Yields the records of a file of JSON objects, one per line"""
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(f):
+    """Yields the records of a UTF-8 encoded CSV file with a header line"""
+    for row in csv.DictReader(f):
+        # missing fields are None, extra ones are listed under None
+        if None in row or None in row.values():
+            # loaded as an invalid record
+            yield {}
+            continue
+        yield dict((key, value.decode('utf-8')) for key, value in row.items())
+
+
+#: Readers of supported formats
+READERS = {'ndjson': read_ndjson,
+           'csv': read_csv}
+
+
+def load(records, user=None, batch_size=1000, progress=None):
+    """Creates the favorites described by ``records``.
+
+    :param user: :class:`django.contrib.auth.models.User` of records
+                 without a ``user``.
+    :param progress: called with the statistics after each batch.
+    :returns: a dictionary counting records ``read``, favorites ``created``,
+              ``duplicate`` records and ``invalid`` ones (unknown user,
+              content type or object, malformed row or date).
+    """
+    stats = {'read': 0, 'created': 0, 'duplicate': 0, 'invalid': 0}
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return stats
+        stats['read'] += len(batch)
+        with signals.changes(Favorite.objects.db):
+            _load_batch(batch, user, stats)
+        if progress is not None:
+            progress(stats)
+
+
+def _load_batch(records, default_user, stats):
+    users = _users(records)
+    favorites = []
+    for record in records:
+        options = _options(record.get('content_type'))
+        user = users.get(record.get('user')) if record.get('user') else default_user
+        try:
+            object_id = int(record.get('object_id'))
+        except (TypeError, ValueError):
+            object_id = None
+        if options is None or user is None or object_id is None:
+            stats['invalid'] += 1
+            continue
+        favorite = Favorite(user=user, content_type_id=options.content_type_id,
+                            object_id=object_id, shared=_boolean(record.get('shared')))
+        favorite.folder_name = record.get('folder') or None
+        if record.get('created_on'):
+            try:
+                favorite.created_on = parse_datetime(record['created_on'])
+            except ValueError:
+                # well formatted but out of range, e.g. February 30
+                favorite.created_on = None
+            if favorite.created_on is None:
+                stats['invalid'] += 1
+                continue
+        favorites.append(favorite)
+
+    by_content_type = {}
+    for favorite in favorites:
+        by_content_type.setdefault(favorite.content_type_id, []).append(favorite)
+    new = []
+    for content_type_id, candidates in by_content_type.items():
+        valid = _existing_objects(content_type_id, candidates)
+        existing = _existing_favorites(content_type_id, candidates)
+        for favorite in candidates:
+            key = (favorite.user.pk, favorite.object_id)
+            if favorite.object_id not in valid:
+                stats['invalid'] += 1
+            elif key in existing:
+                stats['duplicate'] += 1
+            else:
+                existing.add(key)
+                new.append(favorite)
+
+    _set_folders(new)
+    Favorite.objects.bulk_create(new)
+    stats['created'] += len(new)
+    _update_counters(new)
+    signals.notify('added', new)
+
+
+def _options(label):
+    try:
+        app_label, model = label.split('.')
+    except (AttributeError, ValueError):
+        return None
+    return registry.get_by_name(app_label, model)
+
+
+def _boolean(value):
+    if isinstance(value, basestring):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def _users(records):
+    """Returns a dictionary mapping the usernames of ``records`` to users"""
+    usernames = set(record['user'] for record in records if record.get('user'))
+    if not usernames:
+        return {}
+    return dict((user.username, user) for user in User.objects.filter(username__in=usernames))
+
+
+def _existing_objects(content_type_id, favorites):
+    """Returns the set of object ids of ``favorites`` that exist"""
+    model = registry.get_by_content_type_id(content_type_id).model
+    object_ids = set(favorite.object_id for favorite in favorites)
+    return set(model._default_manager.filter(pk__in=object_ids).values_list('pk', flat=True))
+
+
+def _existing_favorites(content_type_id, favorites):
+    """Returns the set of ``(user_id, object_id)`` of ``favorites`` that
+    are already in the database"""
+    qs = Favorite.objects.filter(content_type=content_type_id,
+                                 user__in=set(favorite.user.pk for favorite in favorites),
+                                 object_id__in=set(favorite.object_id for favorite in favorites))
+    return set(qs.values_list('user', 'object_id'))
+
+
+def _set_folders(favorites):
+    """Sets the folders of ``favorites`` from their ``folder_name``,
+    creating missing folders"""
+    names = set((favorite.user.pk, favorite.folder_name)
+                for favorite in favorites if favorite.folder_name)
+    if not names:
+        return
+    user_ids = set(user_id for user_id, _ in names)
+    qs = Folder.objects.filter(user__in=user_ids, name__in=set(name for _, name in names))
+    folders = dict(((folder.user_id, folder.name), folder) for folder in qs)
+    missing = names.difference(folders)
+    if missing:
+        Folder.objects.bulk_create([Folder(user_id=user_id, name=name)
+                                    for user_id, name in missing])
+        qs = Folder.objects.filter(user__in=user_ids, name__in=set(name for _, name in missing))
+        folders.update(((folder.user_id, folder.name), folder) for folder in qs)
+    for favorite in favorites:
+        if favorite.folder_name:
+            favorite.folder = folders[(favorite.user.pk, favorite.folder_name)]
+
+
+def _update_counters(favorites):
+    """Adds ``favorites`` to the counters and buckets of their objects,
+    drops the cached favorites of their users and bumps their versions"""
+    counts = {}
+    buckets = {}
+    for favorite in favorites:
+        key = (favorite.content_type_id, favorite.object_id)
+        counts[key] = counts.get(key, 0) + 1
+        key = (favorite.content_type_id, favorite.object_id, favorite.created_on.date())
+        buckets[key] = buckets.get(key, 0) + 1
+    # objects incremented by the same delta are updated together
+    deltas = {}
+    for (content_type_id, object_id), delta in counts.items():
+        deltas.setdefault((content_type_id, delta), []).append(object_id)
+    for (content_type_id, delta), object_ids in deltas.items():
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        FavoriteCount.objects.increment_many(content_type, object_ids, delta)
+    deltas = {}
+    for (content_type_id, object_id, day), delta in buckets.items():
+        deltas.setdefault((content_type_id, day, delta), []).append(object_id)
+    for (content_type_id, day, delta), object_ids in deltas.items():
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        FavoriteBucket.objects.increment(content_type, object_ids, day, delta)
+    for user_id, content_type_id in set((f.user.pk, f.content_type_id) for f in favorites):
+        cache.invalidate(user_id, content_type_id)
+    for user_id in set(f.user.pk for f in favorites):
+        FavoriteVersion.objects.touch(user_id)
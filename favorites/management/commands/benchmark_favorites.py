@@ -0,0 +1,50 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.test.simple import DjangoTestSuiteRunner
+
+from favorites import benchmark
+
+
+class Command(NoArgsCommand):
+    help = ("Seeds a test database and reports SQL query counts and wall time of "
+            "favorites views and template tags. Fails if a query count exceeds its baseline.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--users', type='int', default=10,
+                    help='Number of users to create.'),
+        make_option('--folders', type='int', default=5,
+                    help='Number of folders per user.'),
+        make_option('--favorites', type='int', default=100,
+                    help='Number of favorites per user.'),
+        make_option('--output', default=None,
+                    help='Write the JSON report to this file instead of the standard output.'),
+        make_option('--baselines', default=benchmark.BASELINES,
+                    help='JSON file of query count baselines.'),
+        make_option('--update-baselines', action='store_true', default=False,
+                    help='Record the query counts of this run as baselines.'),
+    )
+
+    def handle_noargs(self, **options):
+        runner = DjangoTestSuiteRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            users = benchmark.seed(options['users'], options['folders'], options['favorites'])
+            report = benchmark.run(users[0])
+        finally:
+            runner.teardown_databases(old_config)
+
+        output = json.dumps(report, indent=4, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output + '\n')
+
+        if options['update_baselines']:
+            benchmark.save_baselines(report, options['baselines'])
+            return
+        failures = benchmark.regressions(report, benchmark.load_baselines(options['baselines']))
+        if failures:
+            raise CommandError('\n'.join('%s ran %s queries, baseline is %s' % failure
+                                         for failure in failures))
@@ -0,0 +1,34 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from favorites import export
+
+
+class Command(BaseCommand):
+    args = '<username>'
+    help = "Writes the favorites of a user as NDJSON or CSV, streaming them in chunks."
+    option_list = BaseCommand.option_list + (
+        make_option('--format', default='ndjson', choices=sorted(export.FORMATS),
+                    help='Output format: ndjson (default) or csv.'),
+        make_option('--output', default=None,
+                    help='Write to this file instead of the standard output.'),
+        make_option('--chunk-size', type='int', default=1000,
+                    help='Number of favorites read per query.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: export_favorites %s' % self.args)
+        try:
+            user = User.objects.get(username=args[0])
+        except User.DoesNotExist:
+            raise CommandError('No such user %r' % args[0])
+        lines = export.export(user, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line)
@@ -0,0 +1,50 @@
+import itertools
+import os
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from favorites import load
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = ("Loads favorites from a NDJSON or CSV file, as written by export_favorites, "
+            "in batches. Existing favorites are skipped, so a load can be run again.")
+    option_list = BaseCommand.option_list + (
+        make_option('--format', default=None, choices=sorted(load.READERS),
+                    help='Input format: ndjson or csv, guessed from the file extension by default.'),
+        make_option('--user', default=None,
+                    help='Username of the favorites of records without a user.'),
+        make_option('--batch-size', type='int', default=1000,
+                    help='Number of records loaded per batch.'),
+        make_option('--skip', type='int', default=0,
+                    help='Number of records to skip, to resume an interrupted load.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: load_favorites %s' % self.args)
+        path = args[0]
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if format not in load.READERS:
+            raise CommandError('Unknown format %r, use --format' % format)
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError('No such user %r' % options['user'])
+        verbosity = int(options.get('verbosity', 1))
+        skip = options['skip']
+
+        def progress(stats):
+            if verbosity > 0:
+                self.stdout.write("%(read)s records read, %(created)s created, "
+                                  "%(duplicate)s duplicate, %(invalid)s invalid\n"
+                                  % dict(stats, read=stats['read'] + skip))
+
+        with open(path, 'rb') as f:
+            records = itertools.islice(load.READERS[format](f), skip, None)
+            load.load(records, user, options['batch_size'], progress)
@@ -0,0 +1,16 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from favorites.models import FavoriteCount, FavoriteBucket
+
+
+class Command(NoArgsCommand):
+    help = "Recomputes the denormalized favorite counters and daily buckets from the favorites table."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        created = FavoriteCount.objects.rebuild()
+        buckets = FavoriteBucket.objects.rebuild()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write("Rebuilt %s favorite counters\n" % created)
+            self.stdout.write("Rebuilt %s favorite buckets\n" % buckets)
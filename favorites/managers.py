@@ -1,49 +1,153 @@
-from django.db import models, connection
+import datetime
+
+from django.db import models, connection, connections, transaction, IntegrityError
+from django.db.models.deletion import Collector
+from django.db.models.query import QuerySet
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from favorites import cache, registry, signals
+
+try:
+    from sqlite3 import sqlite_version_info
+except ImportError:
+    # Python built without SQLite
+    sqlite_version_info = (0,)
 
 
 qn = connection.ops.quote_name
 
 
+def _is_counted(content_type):
+    """Returns True if counters are maintained for ``content_type``, a
+    :class:`django.contrib.contenttypes.models.ContentType` or its id,
+    see :func:`favorites.register`."""
+    if not isinstance(content_type, ContentType):
+        content_type = ContentType.objects.get_for_id(content_type)
+    return registry.get_options(content_type.model_class()).counter
+
+
+def _bump(content_type, object_ids):
+    """Drops the cached ``add_remove_favorite`` fragments of objects whose
+    counters change, see :func:`favorites.cache.bump_object_versions`."""
+    if isinstance(content_type, ContentType):
+        content_type = content_type.pk
+    cache.bump_object_versions(content_type, object_ids)
+
+
 class FavoritesManagerMixin(object):
     """A Mixin to add a `favorite__favorite` column via extra"""
-    def with_favorite_for(self, user, all=True):
+    def with_favorite_for(self, user, all=True, count=False):
         """ Adds a column favorite__favorite to the returned object, which
-        indicates whether or not this item is a favorite for a user
+        indicates whether or not this item is a favorite for a user.
+
+        The flag is computed with an ``EXISTS`` subquery looking up the
+        ``(user, content_type, object_id)`` unique index.
+
+        :param all: if ``False`` only returns the favorites of ``user``.
+        :param count: if ``True`` also adds a column favorite__count with the
+                      number of favorites of each item, read from
+                      :class:`favorites.models.FavoriteCount` unless the
+                      model was registered with ``counter=False``.
         """
         Favorite = models.get_model('favorites', 'Favorite')
+        FavoriteCount = models.get_model('favorites', 'FavoriteCount')
         content_type = ContentType.objects.get_for_model(self.model)
         pk_field = "%s.%s" % (qn(self.model._meta.db_table),
                               qn(self.model._meta.pk.column))
+        favorites_db_table = qn(Favorite._meta.db_table)
+        params = (user.pk, content_type.pk)
 
-        favorite_sql = """(SELECT 1 FROM %(favorites_db_table)s 
-WHERE %(favorites_db_table)s.object_id = %(pk_field)s and
-      %(favorites_db_table)s.content_type_id = %(content_type)d and
-      %(favorites_db_table)s.user_id = %(user_id)d)
-""" % {'pk_field': pk_field, \
-           'db_table': qn(self.model._meta.db_table), \
-           'favorites_db_table': qn(Favorite._meta.db_table), \
-           'user_id': user.pk, \
-           'content_type': content_type.id, \
-           }
+        qs = self.get_query_set()
+        if all:
+            favorite_sql = """EXISTS (SELECT 1 FROM %(favorites_db_table)s
+WHERE %(favorites_db_table)s.user_id = %%s AND
+      %(favorites_db_table)s.content_type_id = %%s AND
+      %(favorites_db_table)s.object_id = %(pk_field)s)""" % {
+                'favorites_db_table': favorites_db_table,
+                'pk_field': pk_field,
+                }
+            qs = qs.extra(select={'favorite__favorite': favorite_sql},
+                          select_params=params)
+        else:
+            where_sql = """%(pk_field)s IN (SELECT %(favorites_db_table)s.object_id
+FROM %(favorites_db_table)s
+WHERE %(favorites_db_table)s.user_id = %%s AND
+      %(favorites_db_table)s.content_type_id = %%s)""" % {
+                'favorites_db_table': favorites_db_table,
+                'pk_field': pk_field,
+                }
+            qs = qs.extra(select={'favorite__favorite': '1'},
+                          where=[where_sql], params=params)
 
-        extras = {
-            'select': {'favorite__favorite': favorite_sql},
-            }
+        if count and not registry.get_options(self.model).counter:
+            count_sql = """(SELECT COUNT(*) FROM %(favorites_db_table)s
+WHERE %(favorites_db_table)s.content_type_id = %%s AND
+      %(favorites_db_table)s.object_id = %(pk_field)s)""" % {
+                'favorites_db_table': favorites_db_table,
+                'pk_field': pk_field,
+                }
+            qs = qs.extra(select={'favorite__count': count_sql},
+                          select_params=(content_type.pk,))
+        elif count:
+            counts_db_table = qn(FavoriteCount._meta.db_table)
+            count_sql = """COALESCE((SELECT %(counts_db_table)s.%(count)s FROM %(counts_db_table)s
+WHERE %(counts_db_table)s.content_type_id = %%s AND
+      %(counts_db_table)s.object_id = %(pk_field)s), 0)""" % {
+                'counts_db_table': counts_db_table,
+                'count': qn(FavoriteCount._meta.get_field('count').column),
+                'pk_field': pk_field,
+                }
+            qs = qs.extra(select={'favorite__count': count_sql},
+                          select_params=(content_type.pk,))
+        return qs
 
-        if not all:
-            extras['where'] = ['favorite__favorite == 1']
 
-        return self.get_query_set().extra(**extras)
+class FavoriteQuerySet(QuerySet):
+    """A QuerySet for Favorites"""
+    def with_content_objects(self):
+        """Fetches the favorited objects along with the favorites: one query per
+        content type instead of one query per favorite when ``content_object``
+        is accessed."""
+        return self.prefetch_related('content_object')
 
 
 class FavoriteManager(models.Manager):
     """A Manager for Favorites"""
+    def get_query_set(self):
+        return FavoriteQuerySet(self.model, using=self._db)
+
+    def with_content_objects(self):
+        """See :meth:`favorites.managers.FavoriteQuerySet.with_content_objects`"""
+        return self.get_query_set().with_content_objects()
+
     def favorites_for_user(self, user):
         """ Returns Favorites for a specific user
         """
         return self.get_query_set().filter(user=user)
 
+    def _shared(self, queryset):
+        """Filters shared favorites of ``queryset`` with a literal condition:
+        query planners match it against the ``WHERE`` clause of the partial
+        indexes of ``sql/favorite.<backend>.sql``, they can't match a bound
+        parameter."""
+        column = '%s.%s' % (qn(self.model._meta.db_table),
+                            qn(self.model._meta.get_field('shared').column))
+        if connection.vendor == 'postgresql':
+            condition = column
+        else:
+            condition = '%s = 1' % column
+        return queryset.extra(where=[condition]).order_by('-created_on', '-id')
+
+    def shared_for_user(self, user):
+        """Returns the shared favorites of ``user``, most recent first"""
+        return self._shared(self.favorites_for_user(user))
+
+    def recent_shared(self):
+        """Returns the shared favorites of every user, most recent first"""
+        return self._shared(self.get_query_set())
+
     def favorites_for_model(self, model, user=None):
         """Returns Favorites for a specific model"""
         content_type = ContentType.objects.get_for_model(model)
@@ -58,6 +162,8 @@ class FavoriteManager(models.Manager):
         qs = self.get_query_set().filter(content_type=content_type, 
                                          object_id=obj.pk)
         if user:
+            if self._is_cached_non_favorite(obj, user):
+                return qs.none()
             qs = qs.filter(user=user)
 
         return qs
@@ -70,23 +176,59 @@ class FavoriteManager(models.Manager):
 
         content_type = ContentType.objects.get_for_model(object_list[0])
 
-        qs = self.get_query_set().filter(content_type=content_type,
-                                         object_id__in=object_ids)
-        counters = qs.values('object_id').annotate(count=models.Count('object_id'))
+        if registry.get_options(type(object_list[0])).counter:
+            FavoriteCount = models.get_model('favorites', 'FavoriteCount')
+            counters = FavoriteCount.objects.filter(content_type=content_type,
+                                                    object_id__in=object_ids,
+                                                    count__gt=0)
+            counters = counters.values_list('object_id', 'count')
+        else:
+            qs = self.get_query_set().filter(content_type=content_type,
+                                             object_id__in=object_ids)
+            counters = qs.values_list('object_id').annotate(count=models.Count('id')).order_by()
         results = {}
-        for c in counters:
-            results.setdefault(c['object_id'], {})['count'] = c['count']
-            results.setdefault(c['object_id'], {})['is_favorite'] = False
-            results.setdefault(c['object_id'], {})['content_type_id'] = content_type.id
+        for object_id, count in counters:
+            results.setdefault(object_id, {})['count'] = count
+            results.setdefault(object_id, {})['is_favorite'] = False
+            results.setdefault(object_id, {})['content_type_id'] = content_type.id
         if user and user.is_authenticated():
-            qs = qs.filter(user=user)
-            for f in qs:
-                results.setdefault(f.object_id, {})['is_favorite'] = True
+            qs = self.get_query_set().filter(content_type=content_type,
+                                             object_id__in=object_ids,
+                                             user=user)
+            for object_id in qs.values_list('object_id', flat=True):
+                results.setdefault(object_id, {})['is_favorite'] = True
 
         return results
 
+    def favorited_object_ids(self, user, model):
+        """Returns the set of ids of ``model`` objects favorited by ``user``.
+
+        The set is loaded with a single query the first time it is requested
+        for a content type and memoized on the ``user`` instance, hence for
+        ``request.user`` it lives as long as the request."""
+        content_type = ContentType.objects.get_for_model(model)
+        memo = user.__dict__.setdefault('_favorited_object_ids', {})
+        if content_type.pk not in memo:
+            object_ids = cache.get_object_ids(user.pk, content_type.pk)
+            if object_ids is None:
+                qs = self.get_query_set().filter(user=user, content_type=content_type)
+                object_ids = set(qs.values_list('object_id', flat=True))
+                cache.set_object_ids(user.pk, content_type.pk, object_ids,
+                                     registry.get_options(model).cache_ttl)
+            memo[content_type.pk] = object_ids
+        return memo[content_type.pk]
+
+    def _is_cached_non_favorite(self, obj, user):
+        """Returns True if the favorites cache is enabled and knows that
+        ``obj`` is not a favorite of ``user``."""
+        if cache.get_favorites_cache() is None:
+            return False
+        return obj.pk not in self.favorited_object_ids(user, type(obj))
+
     def favorite_for_user(self, obj, user):
         """Returns the favorite, if exists for obj by user"""
+        if self._is_cached_non_favorite(obj, user):
+            raise self.model.DoesNotExist
         content_type = ContentType.objects.get_for_model(type(obj))
         return self.get_query_set().get(content_type=content_type,
                                     user=user, object_id=obj.pk)
@@ -112,3 +254,489 @@ class FavoriteManager(models.Manager):
             )
         favorite.save()
         return favorite
+
+    def _favorite_created(self, favorite):
+        """Updates counters and buckets and sends signals of a new favorite"""
+        FavoriteCount = models.get_model('favorites', 'FavoriteCount')
+        FavoriteCount.objects.increment(favorite.content_type, favorite.object_id)
+        FavoriteBucket = models.get_model('favorites', 'FavoriteBucket')
+        FavoriteBucket.objects.increment(favorite.content_type, [favorite.object_id],
+                                         favorite.created_on.date())
+        signals.notify('added', [favorite])
+
+    def get_or_create_favorite(self, content_object, user, folder=None):
+        """Creates a :class:`favorites.models.Favorite` of ``content_object``
+        for ``user`` unless it exists, in a way that is safe against
+        concurrent creations of the same favorite.
+
+        The favorite is inserted with ``INSERT ... ON CONFLICT DO NOTHING``
+        on PostgreSQL 9.5+, ``INSERT OR IGNORE`` on SQLite and ``INSERT ... ON
+        DUPLICATE KEY UPDATE`` on MySQL, otherwise it's created in a
+        savepoint rolled back if the favorite exists.
+
+        :param folder: :class:`favorites.models.Folder` where to put the
+                       favorite in, if it's created.
+        :returns: a ``(favorite, created)`` tuple.
+        """
+        content_type = ContentType.objects.get_for_model(type(content_object))
+        favorite = self.model(user=user,
+                              content_type=content_type,
+                              object_id=content_object.pk,
+                              content_object=content_object,
+                              folder=folder)
+        with signals.changes(self.db):
+            created = self._insert_ignore(favorite)
+            if created:
+                self._favorite_created(favorite)
+            elif created is None:
+                # Favorite.save updates counters of the favorite
+                sid = transaction.savepoint(using=self.db)
+                try:
+                    favorite.save(using=self.db)
+                    transaction.savepoint_commit(sid, using=self.db)
+                    created = True
+                except IntegrityError:
+                    transaction.savepoint_rollback(sid, using=self.db)
+                    created = False
+        if not created:
+            favorite = self.get_query_set().get(user=user, content_type=content_type,
+                                                object_id=content_object.pk)
+            return favorite, False
+        return favorite, True
+
+    def _insert_ignore(self, favorite):
+        """Inserts ``favorite`` unless it violates a unique constraint, and
+        sends ``pre_save`` and ``post_save`` like :meth:`Model.save` does.
+
+        :returns: ``True`` if it was inserted, ``False`` if it already
+                  exists and ``None`` if the database has no such statement.
+        """
+        connection = connections[self.db]
+        fields = [f for f in self.model._meta.local_fields if f is not self.model._meta.pk]
+        suffix = ''
+        if connection.vendor == 'sqlite' and sqlite_version_info >= (3, 24):
+            # unlike INSERT OR IGNORE, only ignores unique constraints
+            insert = 'INSERT'
+            suffix = ' ON CONFLICT DO NOTHING'
+        elif connection.vendor == 'mysql':
+            # unlike INSERT IGNORE, only ignores duplicate keys
+            insert = 'INSERT'
+            pk = qn(self.model._meta.pk.column)
+            suffix = ' ON DUPLICATE KEY UPDATE %s = %s' % (pk, pk)
+        elif connection.vendor == 'postgresql' and getattr(connection, 'pg_version', 0) >= 90500:
+            insert = 'INSERT'
+            suffix = ' ON CONFLICT DO NOTHING RETURNING %s' % qn(self.model._meta.pk.column)
+        else:
+            return None
+        sql = '%s INTO %s (%s) VALUES (%s)%s' % (
+            insert,
+            qn(self.model._meta.db_table),
+            ', '.join(qn(f.column) for f in fields),
+            ', '.join(['%s'] * len(fields)),
+            suffix)
+        models.signals.pre_save.send(sender=self.model, instance=favorite,
+                                     raw=False, using=self.db)
+        params = [f.get_db_prep_save(f.pre_save(favorite, True), connection=connection)
+                  for f in fields]
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        if connection.vendor == 'postgresql':
+            row = cursor.fetchone()
+            favorite.pk = row[0] if row else None
+        elif connection.vendor == 'mysql':
+            # no id is generated for an existing favorite, and the number of
+            # rows doesn't tell since Django connects with CLIENT.FOUND_ROWS
+            favorite.pk = cursor.lastrowid or None
+        elif cursor.rowcount == 1:
+            favorite.pk = cursor.lastrowid
+        transaction.commit_unless_managed(using=self.db)
+        if favorite.pk is None:
+            return False
+        favorite._state.db = self.db
+        favorite._state.adding = False
+        favorite._forget_user_favorites()
+        models.signals.post_save.send(sender=self.model, instance=favorite,
+                                      created=True, raw=False, using=self.db)
+        return True
+
+    def most_favorited(self, model, since=None, limit=10):
+        """Returns the ``limit`` objects of ``model`` with the most favorites.
+
+        Favorites are summed from the daily
+        :class:`favorites.models.FavoriteBucket` rows, so ``since`` is
+        rounded down to the day. Models registered with ``counter=False``
+        are aggregated from the favorites table.
+
+        :param since: only counts favorites created since this date or
+                      datetime, all of them if ``None``.
+        :returns: a list of ``(object, count)`` tuples, most favorited first.
+        """
+        if isinstance(since, datetime.datetime):
+            since = since.date()
+        content_type = ContentType.objects.get_for_model(model)
+        if registry.get_options(model).counter:
+            FavoriteBucket = models.get_model('favorites', 'FavoriteBucket')
+            qs = FavoriteBucket.objects.filter(content_type=content_type)
+            if since is not None:
+                qs = qs.filter(day__gte=since)
+            rows = qs.values_list('object_id').annotate(total=models.Sum('count'))
+        else:
+            qs = self.get_query_set().filter(content_type=content_type)
+            if since is not None:
+                qs = qs.filter(created_on__gte=since)
+            rows = qs.values_list('object_id').annotate(total=models.Count('id'))
+        rows = list(rows.filter(total__gt=0).order_by('-total', 'object_id')[:limit])
+        objects = model._default_manager.in_bulk([object_id for object_id, _ in rows])
+        return [(objects[object_id], total) for object_id, total in rows
+                if object_id in objects]
+
+
+    def _object_ids_by_content_type(self, objects):
+        """Returns a dictionary mapping content types to the ids of ``objects``
+        of that type, content types are resolved once per model."""
+        object_ids = {}
+        for obj in objects:
+            object_ids.setdefault(type(obj), []).append(obj.pk)
+        content_types = ContentType.objects.get_for_models(*object_ids.keys())
+        return dict((content_types[model], ids) for model, ids in object_ids.items())
+
+    def bulk_create_favorites(self, objects, user, folder=None, batch_size=500):
+        """Creates favorites of ``user`` for every object of ``objects`` that
+        is not already one of his or her favorites.
+
+        Existing favorites are looked up and new ones inserted with batched
+        queries per content type.
+
+        :param folder: :class:`favorites.models.Folder` where to put the favorites in.
+        :returns: the number of favorites created.
+        """
+        FavoriteCount = models.get_model('favorites', 'FavoriteCount')
+        FavoriteBucket = models.get_model('favorites', 'FavoriteBucket')
+        created = 0
+        with signals.changes(self.db):
+            for content_type, object_ids in self._object_ids_by_content_type(objects).items():
+                for i in range(0, len(object_ids), batch_size):
+                    batch = set(object_ids[i:i + batch_size])
+                    qs = self.get_query_set().filter(user=user, content_type=content_type,
+                                                     object_id__in=batch)
+                    new_ids = batch.difference(qs.values_list('object_id', flat=True))
+                    if not new_ids:
+                        continue
+                    favorites = [self.model(user=user,
+                                            content_type=content_type,
+                                            object_id=object_id,
+                                            folder=folder)
+                                 for object_id in new_ids]
+                    self.bulk_create(favorites)
+                    FavoriteCount.objects.increment_many(content_type, new_ids)
+                    FavoriteBucket.objects.increment_by_day(
+                        content_type, [(f.object_id, f.created_on) for f in favorites])
+                    signals.notify('added', favorites)
+                    created += len(new_ids)
+                cache.invalidate(user.pk, content_type.pk)
+            user.__dict__.pop('_favorited_object_ids', None)
+            if created:
+                self._touch(user)
+        return created
+
+    def bulk_remove_favorites(self, objects, user, batch_size=500):
+        """Removes favorites of ``user`` for every object of ``objects``.
+
+        :returns: the number of favorites removed.
+        """
+        FavoriteCount = models.get_model('favorites', 'FavoriteCount')
+        FavoriteBucket = models.get_model('favorites', 'FavoriteBucket')
+        removed = 0
+        with signals.changes(self.db):
+            for content_type, object_ids in self._object_ids_by_content_type(objects).items():
+                for i in range(0, len(object_ids), batch_size):
+                    qs = self.get_query_set().filter(user=user, content_type=content_type,
+                                                     object_id__in=object_ids[i:i + batch_size])
+                    favorites = list(qs)
+                    if not favorites:
+                        continue
+                    # deletes the favorites already loaded, QuerySet.delete
+                    # would select them again; favorites.models.favorite_deleted
+                    # skips them, counters are updated once per batch below
+                    for favorite in favorites:
+                        favorite._bulk_removed = True
+                    collector = Collector(using=self.db)
+                    collector.collect(favorites)
+                    collector.delete()
+                    FavoriteCount.objects.decrement_many(
+                        content_type, [f.object_id for f in favorites])
+                    FavoriteBucket.objects.increment_by_day(
+                        content_type, [(f.object_id, f.created_on) for f in favorites], -1)
+                    signals.notify('removed', favorites)
+                    removed += len(favorites)
+                cache.invalidate(user.pk, content_type.pk)
+            user.__dict__.pop('_favorited_object_ids', None)
+            if removed:
+                self._touch(user)
+        return removed
+
+    def _touch(self, user):
+        FavoriteVersion = models.get_model('favorites', 'FavoriteVersion')
+        FavoriteVersion.objects.touch(user.pk)
+
+
+class FolderManager(models.Manager):
+    """A Manager for Folders"""
+    def with_favorite_counts(self, user):
+        """Returns the folders of ``user`` with a ``favorite_count`` attribute
+        and the ``last_favorited_on`` date of their most recent favorite,
+        ``None`` for empty folders.
+
+        Favorites are counted with a single query grouped by folder.
+
+        :returns: a list of :class:`favorites.models.Folder`, starting with
+                  an unsaved folder without ``pk`` standing for the favorites
+                  that are not in a folder.
+        """
+        Favorite = models.get_model('favorites', 'Favorite')
+        rows = Favorite.objects.filter(user=user).values_list('folder')
+        rows = rows.annotate(count=models.Count('id'), last=models.Max('created_on'))
+        counts = dict((folder_id, (count, last)) for folder_id, count, last in rows.order_by())
+        root = self.model(user=user, name=_('No folder'))
+        folders = [root] + list(self.get_query_set().filter(user=user))
+        for folder in folders:
+            folder.favorite_count, folder.last_favorited_on = counts.get(folder.pk, (0, None))
+        return folders
+
+
+class FavoriteEventManager(models.Manager):
+    """A Manager for the outbox of favorite changes"""
+    def after(self, event_id, limit=1000):
+        """Returns the ``limit`` first events following the event ``event_id``,
+        ``0`` to start from the first event."""
+        return self.get_query_set().filter(pk__gt=event_id).order_by('pk')[:limit]
+
+
+class FavoriteVersionManager(models.Manager):
+    """A Manager for the versions of users' favorites"""
+    def touch(self, user_id, create=True):
+        """Increments the version of the favorites of user ``user_id``
+
+        :param create: creates the version if the user has none, a user
+                       without version never gets a not modified response.
+        """
+        now = timezone.now()
+        qs = self.get_query_set().filter(user=user_id)
+        if qs.update(version=models.F('version') + 1, modified_on=now) or not create:
+            return
+        sid = transaction.savepoint(using=self.db)
+        try:
+            self.create(user_id=user_id, version=1, modified_on=now)
+            transaction.savepoint_commit(sid, using=self.db)
+        except IntegrityError:
+            # someone else created the version in the meantime
+            transaction.savepoint_rollback(sid, using=self.db)
+            qs.update(version=models.F('version') + 1, modified_on=now)
+
+    def get_for_user(self, user):
+        """Returns the :class:`favorites.models.FavoriteVersion` of ``user``,
+        ``None`` if his or her favorites never changed"""
+        versions = list(self.get_query_set().filter(user=user)[:1])
+        return versions[0] if versions else None
+
+
+class FavoriteCountManager(models.Manager):
+    """A Manager for the denormalized favorite counters"""
+    def count_for_object(self, obj):
+        """Returns the number of favorites for a specific object"""
+        if not registry.get_options(type(obj)).counter:
+            Favorite = models.get_model('favorites', 'Favorite')
+            return Favorite.objects.favorites_for_object(obj).count()
+        content_type = ContentType.objects.get_for_model(type(obj))
+        qs = self.get_query_set().filter(content_type=content_type,
+                                         object_id=obj.pk)
+        counts = qs.values_list('count', flat=True)
+        return counts[0] if counts else 0
+
+    def increment(self, content_type, object_id, delta=1):
+        """Atomically adds ``delta`` to the counter of an object, creating
+        the counter if it doesn't exist yet."""
+        if _is_counted(content_type):
+            self._increment(content_type, object_id, delta)
+        # after the write, so that no fragment is cached with the old count
+        # under the new version
+        _bump(content_type, [object_id])
+
+    def _increment(self, content_type, object_id, delta):
+        qs = self.get_query_set().filter(content_type=content_type,
+                                         object_id=object_id)
+        if qs.update(count=models.F('count') + delta):
+            return
+        sid = transaction.savepoint(using=self.db)
+        try:
+            self.create(content_type=content_type, object_id=object_id,
+                        count=delta)
+            transaction.savepoint_commit(sid, using=self.db)
+        except IntegrityError:
+            # someone else created the counter in the meantime
+            transaction.savepoint_rollback(sid, using=self.db)
+            qs.update(count=models.F('count') + delta)
+
+    def decrement(self, content_type, object_id, delta=1):
+        """Atomically removes ``delta`` from the counter of an object"""
+        if _is_counted(content_type):
+            qs = self.get_query_set().filter(content_type=content_type,
+                                             object_id=object_id,
+                                             count__gte=delta)
+            qs.update(count=models.F('count') - delta)
+        _bump(content_type, [object_id])
+
+    def increment_many(self, content_type, object_ids, delta=1):
+        """Adds ``delta`` to the counters of several objects of the same
+        content type with batched queries."""
+        object_ids = set(object_ids)
+        if _is_counted(content_type):
+            self._increment_many(content_type, object_ids, delta)
+        _bump(content_type, object_ids)
+
+    def _increment_many(self, content_type, object_ids, delta):
+        qs = self.get_query_set().filter(content_type=content_type,
+                                         object_id__in=object_ids)
+        missing = object_ids.difference(qs.values_list('object_id', flat=True))
+        qs.update(count=models.F('count') + delta)
+        if not missing:
+            return
+        sid = transaction.savepoint(using=self.db)
+        try:
+            self.bulk_create([self.model(content_type=content_type,
+                                         object_id=object_id,
+                                         count=delta)
+                              for object_id in missing])
+            transaction.savepoint_commit(sid, using=self.db)
+        except IntegrityError:
+            # some counters were created in the meantime
+            transaction.savepoint_rollback(sid, using=self.db)
+            for object_id in missing:
+                self._increment(content_type, object_id, delta)
+
+    def decrement_many(self, content_type, object_ids, delta=1):
+        """Removes ``delta`` from the counters of several objects of the same
+        content type with a single query."""
+        if _is_counted(content_type):
+            qs = self.get_query_set().filter(content_type=content_type,
+                                             object_id__in=object_ids,
+                                             count__gte=delta)
+            qs.update(count=models.F('count') - delta)
+        _bump(content_type, object_ids)
+
+    def rebuild(self, batch_size=1000):
+        """Recomputes every counter from the favorites table.
+
+        :returns: the number of counters created."""
+        Favorite = models.get_model('favorites', 'Favorite')
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s' % qn(self.model._meta.db_table))
+        rows = Favorite.objects.values_list('content_type', 'object_id')
+        rows = rows.annotate(count=models.Count('id')).order_by()
+        created = 0
+        batch = []
+        for content_type_id, object_id, count in rows.iterator():
+            batch.append(self.model(content_type_id=content_type_id,
+                                    object_id=object_id,
+                                    count=count))
+            if len(batch) == batch_size:
+                self.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            self.bulk_create(batch)
+            created += len(batch)
+        transaction.commit_unless_managed()
+        return created
+
+
+class FavoriteBucketManager(models.Manager):
+    """A Manager for the daily favorite counters"""
+    def increment(self, content_type, object_ids, day, delta=1):
+        """Adds ``delta`` to the buckets of ``day`` of several objects of
+        the same content type, creating missing buckets."""
+        if not _is_counted(content_type):
+            return
+        object_ids = set(object_ids)
+        qs = self.get_query_set().filter(content_type=content_type,
+                                         object_id__in=object_ids,
+                                         day=day)
+        if qs.update(count=models.F('count') + delta) == len(object_ids):
+            return
+        missing = object_ids.difference(qs.values_list('object_id', flat=True))
+        sid = transaction.savepoint(using=self.db)
+        try:
+            self.bulk_create([self.model(content_type=content_type,
+                                         object_id=object_id,
+                                         day=day,
+                                         count=delta)
+                              for object_id in missing])
+            transaction.savepoint_commit(sid, using=self.db)
+        except IntegrityError:
+            # some buckets were created in the meantime
+            transaction.savepoint_rollback(sid, using=self.db)
+            qs = self.get_query_set().filter(content_type=content_type,
+                                             object_id__in=missing,
+                                             day=day)
+            qs.update(count=models.F('count') + delta)
+
+    def decrement(self, content_type, object_ids, day, delta=1):
+        """Removes ``delta`` from the buckets of ``day`` of several objects
+        of the same content type with a single query."""
+        if not _is_counted(content_type):
+            return
+        qs = self.get_query_set().filter(content_type=content_type,
+                                         object_id__in=object_ids,
+                                         day=day,
+                                         count__gte=delta)
+        qs.update(count=models.F('count') - delta)
+
+    def increment_by_day(self, content_type, favorites, delta=1):
+        """Adds ``delta`` (removes it if negative) to the buckets of
+        ``favorites``, an iterable of ``(object_id, created_on)`` tuples,
+        with one batch of queries per day."""
+        days = {}
+        for object_id, created_on in favorites:
+            days.setdefault(created_on.date(), []).append(object_id)
+        for day, object_ids in days.items():
+            if delta > 0:
+                self.increment(content_type, object_ids, day, delta)
+            else:
+                self.decrement(content_type, object_ids, day, -delta)
+
+    def rebuild(self, batch_size=1000):
+        """Recomputes every bucket from the favorites table.
+
+        :returns: the number of buckets created."""
+        Favorite = models.get_model('favorites', 'Favorite')
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s' % qn(self.model._meta.db_table))
+        rows = Favorite.objects.values_list('content_type', 'object_id', 'created_on')
+        rows = rows.order_by('content_type', 'object_id')
+        created = 0
+        batch = []
+        current, days = None, {}
+        for content_type_id, object_id, created_on in rows.iterator():
+            if (content_type_id, object_id) != current:
+                batch.extend(self._buckets(current, days))
+                current, days = (content_type_id, object_id), {}
+            day = created_on.date()
+            days[day] = days.get(day, 0) + 1
+            if len(batch) >= batch_size:
+                self.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        batch.extend(self._buckets(current, days))
+        if batch:
+            self.bulk_create(batch)
+            created += len(batch)
+        transaction.commit_unless_managed()
+        return created
+
+    def _buckets(self, key, days):
+        if key is None:
+            return []
+        content_type_id, object_id = key
+        return [self.model(content_type_id=content_type_id, object_id=object_id,
+                           day=day, count=count)
+                for day, count in days.items()]
@@ -1,10 +1,13 @@
-from django.db import models, connection
+from django.db import models, connection, router
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 
-from favorites.managers import FavoriteManager
+from favorites import cache, signals
+from favorites.managers import (FavoriteManager, FavoriteCountManager, FavoriteBucketManager,
+                                FolderManager, FavoriteEventManager, FavoriteVersionManager)
 
 
 class Folder(models.Model):
@@ -14,6 +17,9 @@ class Folder(models.Model):
     #: name of the folder
     name = models.CharField(max_length=100)
 
+    #: see :class:`favorites.managers.FolderManager`
+    objects = FolderManager()
+
     def __unicode__(self):
         return self.name
 
@@ -32,8 +38,9 @@ class Favorite(models.Model):
 
     #: :class:`favorites.models.Folder`` in which the favorite can be found.
     folder = models.ForeignKey(Folder, null=True, blank=True)
-    #: Date of creation
-    created_on = models.DateTimeField(auto_now_add=True)
+    #: Date of creation, set when the favorite is instantiated so that
+    #: imports can keep the original date
+    created_on = models.DateTimeField(default=timezone.now, editable=False)
     #: Boolean to know if this favorite is shared
     shared = models.BooleanField(default=False)
 
@@ -47,5 +54,216 @@ class Favorite(models.Model):
         unique_together = (('user', 'content_type', 'object_id'),)
 
     def __unicode__(self):
-        object_repr = unicode(self.content_object)
-        return u"%s likes %s" % (self.user, object_repr)
+        """Describes the user and favorited object when they are already
+        loaded, e.g. with ``select_related`` or ``with_content_objects``,
+        and their ids otherwise, so that it never runs a query"""
+        user = getattr(self, '_user_cache', None)
+        if user is None:
+            user = u"#%s" % self.user_id
+        content_object = getattr(self, '_content_object_cache', None)
+        if content_object is None:
+            content_type = ContentType.objects.get_for_id(self.content_type_id)
+            content_object = u"%s #%s" % (content_type.name, self.object_id)
+        return u"%s likes %s" % (user, content_object)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with signals.changes(self._db_for_write(kwargs.get('using'))):
+            super(Favorite, self).save(*args, **kwargs)
+            self._forget_user_favorites()
+            if adding:
+                Favorite.objects._favorite_created(self)
+
+    def move(self, folder):
+        """Moves the favorite to ``folder``, ``None`` for no folder"""
+        old_folder = self.folder
+        self.folder = folder
+        with signals.changes(self._db_for_write()):
+            self.save()
+            signals.notify('moved', [self], old_folder=old_folder)
+
+    def toggle_share(self):
+        """Shares the favorite if it's not shared, unshares it otherwise"""
+        self.shared = not self.shared
+        with signals.changes(self._db_for_write()):
+            self.save()
+            signals.notify('shared_toggled', [self])
+
+    def _db_for_write(self, using=None):
+        return using or router.db_for_write(self.__class__, instance=self)
+
+    def _forget_user_favorites(self, create_version=True):
+        """Drops user's favorites memoized or cached by
+        :meth:`favorites.managers.FavoriteManager.favorited_object_ids`
+        and bumps user's :class:`favorites.models.FavoriteVersion`"""
+        if hasattr(self, '_user_cache'):
+            self._user_cache.__dict__.pop('_favorited_object_ids', None)
+        cache.invalidate(self.user_id, self.content_type_id)
+        FavoriteVersion.objects.touch(self.user_id, create=create_version)
+
+
+class FavoriteCount(models.Model):
+    """Denormalized number of :class:`favorites.models.Favorite` for an object.
+
+    Counters are maintained when a favorite is saved for the first time or
+    deleted, see :func:`favorites.models.favorite_deleted`; bulk operations
+    update them in batches. Use the ``rebuild_favorite_counts`` management
+    command to resynchronize them."""
+    #: Favorited object type
+    content_type = models.ForeignKey(ContentType)
+    #: id of the favorited object
+    object_id = models.PositiveIntegerField()
+    #: number of favorites for this object
+    count = models.PositiveIntegerField(default=0)
+
+    #: see :class:`favorites.managers.FavoriteCountManager`
+    objects = FavoriteCountManager()
+
+    class Meta:
+        verbose_name = _('favorite count')
+        verbose_name_plural = _('favorite counts')
+        unique_together = (('content_type', 'object_id'),)
+
+    def __unicode__(self):
+        return u"%s:%s (%s)" % (self.content_type_id, self.object_id, self.count)
+
+
+class FavoriteBucket(models.Model):
+    """Denormalized number of :class:`favorites.models.Favorite` created on
+    a given day for an object, used to answer leaderboards such as
+    :meth:`favorites.managers.FavoriteManager.most_favorited`.
+
+    Buckets are maintained along with :class:`favorites.models.FavoriteCount`
+    counters, the ``rebuild_favorite_counts`` management command rebuilds
+    them too."""
+    #: Favorited object type
+    content_type = models.ForeignKey(ContentType)
+    #: id of the favorited object
+    object_id = models.PositiveIntegerField()
+    #: day on which the favorites were created
+    day = models.DateField()
+    #: number of favorites created on this day for this object
+    count = models.PositiveIntegerField(default=0)
+
+    #: see :class:`favorites.managers.FavoriteBucketManager`
+    objects = FavoriteBucketManager()
+
+    class Meta:
+        verbose_name = _('favorite bucket')
+        verbose_name_plural = _('favorite buckets')
+        unique_together = (('content_type', 'object_id', 'day'),)
+
+    def __unicode__(self):
+        return u"%s:%s %s (%s)" % (self.content_type_id, self.object_id,
+                                   self.day, self.count)
+
+
+class FavoriteEvent(models.Model):
+    """Outbox of favorite changes, written when ``FAVORITES_OUTBOX`` is
+    ``True``, see :mod:`favorites.signals`.
+
+    Events only keep ids, so that they outlive the favorites, folders and
+    users they describe. Consumers read them in ``id`` order."""
+    EVENT_CHOICES = (('added', _('added')),
+                     ('removed', _('removed')),
+                     ('moved', _('moved')),
+                     ('shared_toggled', _('shared toggled')))
+
+    #: kind of change
+    event = models.CharField(max_length=20, choices=EVENT_CHOICES)
+    #: id of the user owning the favorite
+    user_id = models.PositiveIntegerField()
+    #: Favorited object type
+    content_type = models.ForeignKey(ContentType)
+    #: id of the favorited object
+    object_id = models.PositiveIntegerField()
+    #: id of the folder of the favorite after the change
+    folder_id = models.PositiveIntegerField(null=True, blank=True)
+    #: whether the favorite is shared after the change
+    shared = models.BooleanField(default=False)
+    #: Date of the change
+    created_on = models.DateTimeField(default=timezone.now, editable=False)
+
+    #: see :class:`favorites.managers.FavoriteEventManager`
+    objects = FavoriteEventManager()
+
+    class Meta:
+        verbose_name = _('favorite event')
+        verbose_name_plural = _('favorite events')
+        ordering = ('id',)
+
+    def __unicode__(self):
+        return u"%s %s:%s:%s" % (self.event, self.user_id,
+                                 self.content_type_id, self.object_id)
+
+    @classmethod
+    def for_favorite(cls, event, favorite):
+        """Returns an unsaved event of ``favorite``"""
+        return cls(event=event,
+                   user_id=favorite.user_id,
+                   content_type_id=favorite.content_type_id,
+                   object_id=favorite.object_id,
+                   folder_id=favorite.folder_id,
+                   shared=favorite.shared)
+
+
+class FavoriteVersion(models.Model):
+    """Version of the favorites and folders of a user, incremented whenever
+    one of them changes. List views use it to answer conditional requests,
+    see :func:`favorites.views.favorite_list`."""
+    #: owner of the favorites and folders
+    user = models.ForeignKey(User, unique=True)
+    #: incremented on each change
+    version = models.PositiveIntegerField(default=0)
+    #: date of the last change
+    modified_on = models.DateTimeField(default=timezone.now)
+
+    #: see :class:`favorites.managers.FavoriteVersionManager`
+    objects = FavoriteVersionManager()
+
+    class Meta:
+        verbose_name = _('favorite version')
+        verbose_name_plural = _('favorite versions')
+
+    def __unicode__(self):
+        return u"%s (%s)" % (self.user_id, self.version)
+
+
+def favorite_deleted(sender, instance, **kwargs):
+    """Removes a deleted favorite from the counter and bucket of its object,
+    drops the cached favorites of its user and sends ``favorite_removed``.
+
+    Connected to ``post_delete``, which is sent for each favorite, including
+    favorites deleted with a queryset or along with their folder or user.
+    Favorites removed by ``bulk_remove_favorites`` are counted per batch."""
+    if getattr(instance, '_bulk_removed', False):
+        return
+    FavoriteCount.objects.decrement(instance.content_type_id, instance.object_id)
+    FavoriteBucket.objects.decrement(instance.content_type_id, [instance.object_id],
+                                     instance.created_on.date())
+    # the user, and so his or her version, may be deleted too
+    instance._forget_user_favorites(create_version=False)
+    signals.notify('removed', [instance])
+models.signals.post_delete.connect(favorite_deleted, sender=Favorite,
+                                   dispatch_uid='favorites.models.favorite_deleted')
+
+
+def folder_saved(sender, instance, **kwargs):
+    """Bumps the :class:`favorites.models.FavoriteVersion` of the user of
+    a saved folder."""
+    FavoriteVersion.objects.touch(instance.user_id)
+models.signals.post_save.connect(folder_saved, sender=Folder,
+                                 dispatch_uid='favorites.models.folder_saved')
+
+
+def folder_deleted(sender, instance, **kwargs):
+    """Bumps the :class:`favorites.models.FavoriteVersion` of the user of
+    a deleted folder.
+
+    Connected to ``post_delete``, which is sent for each folder, including
+    folders deleted with a queryset, e.g. by the admin, or along with their
+    user."""
+    # the user, and so his or her version, may be deleted too
+    FavoriteVersion.objects.touch(instance.user_id, create=False)
+models.signals.post_delete.connect(folder_deleted, sender=Folder,
+                                   dispatch_uid='favorites.models.folder_deleted')
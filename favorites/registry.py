@@ -0,0 +1,123 @@
+"""Process-local registry of favoritable models and of their settings.
+
+Models are declared favoritable with :func:`favorites.register`, usually
+from the ``models.py`` of their application::
+
+    import favorites
+
+    favorites.register(Article, counter=False, cache_ttl=60,
+                       select_related=['author'])
+
+``FAVORITES_MODELS`` restricts favoritable models to a list of
+``"app_label.ModelName"`` strings, along with registered models. If it's
+not set, every installed model is favoritable and :func:`favorites.register`
+only changes the settings of a model.
+
+The registry maps models ``(app_label, object_name)`` and content type
+ids to :class:`favorites.registry.FavoriteOptions`, so views resolve their
+URL parameters to a model without database queries and reject unknown
+models from memory. It is loaded with a single query the first time it's
+used, call :func:`favorites.registry.warm` to load it at startup.
+"""
+from django.conf import settings
+from django.db.models import get_model, get_models
+
+
+class FavoriteOptions(object):
+    """Favorite settings of a favoritable model.
+
+    :param counter: maintain :class:`favorites.models.FavoriteCount` counters for
+                    this model, otherwise favorites are counted on the fly.
+    :param cache_ttl: timeout of the favorites cache entries of this model,
+                      see :mod:`favorites.cache`.
+    :param select_related: relations fetched along with the favorited object
+                           by views.
+    """
+    def __init__(self, model, counter=True, cache_ttl=None, select_related=()):
+        self.model = model
+        self.counter = counter
+        self.cache_ttl = cache_ttl
+        self.select_related = tuple(select_related)
+        #: set when the registry is loaded
+        self.content_type_id = None
+
+
+_registered = {}
+_by_name = None
+_by_content_type_id = None
+
+
+def register(model, **options):
+    """Declares ``model`` as favoritable, see :class:`favorites.registry.FavoriteOptions`
+    for ``options``"""
+    _registered[model] = FavoriteOptions(model, **options)
+    reset()
+
+
+def unregister(model):
+    """Removes ``model`` from declared favoritable models"""
+    _registered.pop(model, None)
+    reset()
+
+
+def get_options(model):
+    """Returns the :class:`favorites.registry.FavoriteOptions` of ``model``,
+    default ones if it was not registered"""
+    options = _registered.get(model)
+    if options is None:
+        options = FavoriteOptions(model)
+    return options
+
+
+def _declared_models():
+    labels = getattr(settings, 'FAVORITES_MODELS', None)
+    if labels is None:
+        models = get_models()
+        return models + [model for model in _registered if model not in models]
+    models = list(_registered)
+    for label in labels:
+        model = get_model(*label.split('.'))
+        if model is None:
+            raise ValueError("FAVORITES_MODELS: no such model %r" % label)
+        models.append(model)
+    return models
+
+
+def warm():
+    """Loads favoritable models and their content types"""
+    global _by_name, _by_content_type_id
+    from django.contrib.contenttypes.models import ContentType
+    content_types = ContentType.objects.get_for_models(*_declared_models())
+    by_name = {}
+    by_content_type_id = {}
+    for model, content_type in content_types.items():
+        options = _registered.get(model) or FavoriteOptions(model)
+        options.content_type_id = content_type.pk
+        by_name[(model._meta.app_label, model._meta.object_name.lower())] = options
+        by_content_type_id[content_type.pk] = options
+    _by_name, _by_content_type_id = by_name, by_content_type_id
+
+
+def reset():
+    """Forgets loaded models, they will be loaded again on next use"""
+    global _by_name, _by_content_type_id
+    _by_name = _by_content_type_id = None
+
+
+def get_by_name(app_label, object_name):
+    """Returns the :class:`favorites.registry.FavoriteOptions` of a favoritable
+    model or ``None`` if there's no such model"""
+    if _by_name is None:
+        warm()
+    return _by_name.get((app_label, object_name.lower()))
+
+
+def get_by_content_type_id(content_type_id):
+    """Returns the :class:`favorites.registry.FavoriteOptions` of a favoritable
+    model or ``None`` if there's no such model"""
+    if _by_content_type_id is None:
+        warm()
+    try:
+        return _by_content_type_id.get(int(content_type_id))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,87 @@
+"""Signals sent when favorites change, and the optional outbox.
+
+Each signal is sent with :class:`favorites.models.Favorite` as sender and
+the changed ``favorite`` as argument, once per favorite for bulk operations:
+
+- ``favorite_added`` when a favorite is created,
+- ``favorite_removed`` when a favorite is deleted, including with a
+  queryset or along with its folder or user,
+- ``favorite_moved`` when a favorite moves to another folder, with the
+  ``old_folder`` too,
+- ``favorite_shared_toggled`` when a favorite is shared or unshared.
+
+If ``FAVORITES_OUTBOX`` is ``True``, changes are also written to the
+:class:`favorites.models.FavoriteEvent` table with one query per operation
+(per favorite for deletes), so that other processes can tail them by increasing id instead of polling
+favorites. Changes and their events are committed together, see
+:func:`changes`.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import models, transaction
+from django.dispatch import Signal
+
+
+favorite_added = Signal(providing_args=['favorite'])
+favorite_removed = Signal(providing_args=['favorite'])
+favorite_moved = Signal(providing_args=['favorite', 'old_folder'])
+favorite_shared_toggled = Signal(providing_args=['favorite'])
+
+#: callbacks of the change in progress in each thread, see on_commit
+_pending = threading.local()
+
+#: Signals by event name, as recorded in the outbox
+SIGNALS = {'added': favorite_added,
+           'removed': favorite_removed,
+           'moved': favorite_moved,
+           'shared_toggled': favorite_shared_toggled}
+
+
+def notify(event, favorites, **kwargs):
+    """Sends the signal of ``event`` for each favorite of ``favorites`` and
+    writes them to the outbox if it's enabled"""
+    if not favorites:
+        return
+    signal = SIGNALS[event]
+    for favorite in favorites:
+        signal.send(sender=favorite.__class__, favorite=favorite, **kwargs)
+    if getattr(settings, 'FAVORITES_OUTBOX', False):
+        FavoriteEvent = models.get_model('favorites', 'FavoriteEvent')
+        FavoriteEvent.objects.bulk_create([FavoriteEvent.for_favorite(event, favorite)
+                                           for favorite in favorites])
+
+
+@contextmanager
+def changes(using):
+    """Runs a change of favorites and the events written by :func:`notify`
+    in a transaction of database ``using``, unless a transaction is already
+    managed, e.g. by ``TransactionMiddleware`` or an outer change.
+
+    Callbacks registered with :func:`on_commit` run once the transaction
+    opened here is committed."""
+    if transaction.is_managed(using=using):
+        yield
+        return
+    _pending.callbacks = callbacks = []
+    try:
+        with transaction.commit_on_success(using=using):
+            yield
+    finally:
+        _pending.callbacks = None
+    for callback in callbacks:
+        callback()
+
+
+def on_commit(callback):
+    """Calls ``callback`` once the change in progress is committed, see
+    :func:`changes`, right away outside of a change.
+
+    Caches are dropped this way, so that concurrent requests can't cache
+    again the data of a change that isn't committed yet."""
+    callbacks = getattr(_pending, 'callbacks', None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
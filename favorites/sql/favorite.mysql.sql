@@ -0,0 +1,5 @@
+-- MySQL has no partial indexes, shared favorites are looked up with
+-- composite indexes starting with the shared flag, see
+-- favorites.managers.FavoriteManager.shared_for_user and recent_shared.
+CREATE INDEX favorites_favorite_shared_user_created_on ON favorites_favorite (shared, user_id, created_on, id);
+CREATE INDEX favorites_favorite_shared_created_on ON favorites_favorite (shared, created_on, id);
@@ -0,0 +1,4 @@
+-- Partial indexes of shared favorites, see
+-- favorites.managers.FavoriteManager.shared_for_user and recent_shared.
+CREATE INDEX favorites_favorite_shared_user_created_on ON favorites_favorite (user_id, created_on, id) WHERE shared;
+CREATE INDEX favorites_favorite_shared_created_on ON favorites_favorite (created_on, id) WHERE shared;
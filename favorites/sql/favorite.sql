@@ -0,0 +1,8 @@
+-- Composite indexes matching the query shapes of favorites.managers.
+-- syncdb runs this file when it creates the favorites table, use
+-- ``manage.py sqlcustom favorites`` to get the statements for an
+-- existing database.
+CREATE INDEX favorites_favorite_content_type_object ON favorites_favorite (content_type_id, object_id);
+CREATE INDEX favorites_favorite_user_folder ON favorites_favorite (user_id, folder_id);
+CREATE INDEX favorites_favorite_user_content_type_folder ON favorites_favorite (user_id, content_type_id, folder_id);
+CREATE INDEX favorites_favorite_user_created_on ON favorites_favorite (user_id, created_on);
@@ -0,0 +1,5 @@
+-- Partial indexes of shared favorites, see
+-- favorites.managers.FavoriteManager.shared_for_user and recent_shared.
+-- SQLite appends the rowid, hence the id, to every index.
+CREATE INDEX favorites_favorite_shared_user_created_on ON favorites_favorite (user_id, created_on) WHERE shared = 1;
+CREATE INDEX favorites_favorite_shared_created_on ON favorites_favorite (created_on) WHERE shared = 1;
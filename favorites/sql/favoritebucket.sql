@@ -0,0 +1,3 @@
+-- Covering index of favorites.managers.FavoriteBucketManager.most_favorited,
+-- which sums the buckets of a content type over a range of days.
+CREATE INDEX favorites_favoritebucket_content_type_day ON favorites_favoritebucket (content_type_id, day, object_id, count);
@@ -0,0 +1,44 @@
+/*
+ * Ajax toggle of the links rendered by the ``add_remove_favorite`` template
+ * tag, included once per page by the tag itself.
+ *
+ * The CSRF token is read from the cookie named by the ``data-csrf-cookie``
+ * attribute of this script tag.
+ */
+(function($){
+    var script = $("script[data-csrf-cookie]").last();
+    var cookieName = script.data("csrf-cookie") || "csrftoken";
+
+    function getCookie(name){
+        var cookies = document.cookie ? document.cookie.split(";") : [];
+        for(var i = 0; i < cookies.length; i++){
+            var cookie = $.trim(cookies[i]);
+            if(cookie.substring(0, name.length + 1) == name + "="){
+                return decodeURIComponent(cookie.substring(name.length + 1));
+            }
+        }
+        return null;
+    }
+
+    $(document).on("click", ".favorites-add-remove > a", function(event){
+        event.preventDefault();
+        var link = $(this);
+        var widget = link.closest(".favorites-add-remove");
+        var isFavorite = link.hasClass("has-favorite");
+        $.ajax({
+            url: isFavorite ? widget.data("remove-url") : widget.data("add-url"),
+            type: "POST",
+            data: {
+                content_type_id: widget.data("content-type-id"),
+                object_id: widget.data("object-id"),
+                csrfmiddlewaretoken: getCookie(cookieName)
+            },
+            dataType: "json",
+            success: function(data){
+                link.toggleClass("has-favorite", !isFavorite);
+                widget.find("#count-" + widget.data("content-type-id") + "-" + widget.data("object-id")).text(data.count);
+            }
+        });
+        return false;
+    });
+})(jQuery);
@@ -1,14 +1,18 @@
 from django import template
+from django.conf import settings
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 from django.template import Node
 from django.template import TemplateSyntaxError
 from django.template import Variable
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from django.template.defaulttags import URLNode
 
-from favorites.models import Favorite, Folder
+from favorites import cache
+from favorites.models import Favorite, FavoriteCount, Folder
 from favorites.forms import UserFolderChoicesForm, ValidationForm
 
 
@@ -18,31 +22,93 @@ register = template.Library()
 @register.filter
 def is_favorite(object, user):
     """
-    Returns True, if object is already in user`s favorite list
+    Returns True, if object is already in user`s favorite list.
+
+    User's favorites are fetched once per content type and request, see
+    :meth:`favorites.managers.FavoriteManager.favorited_object_ids`.
     """
     if not user or not user.is_authenticated():
         return False
-    query = Favorite.objects.favorites_for_object(object, user)
-    count = query.count()
-    return count > 0
+    return object.pk in Favorite.objects.favorited_object_ids(user, type(object))
+
+
+SCRIPT = '<script type="text/javascript" src="%sfavorites/js/favorites.js" data-csrf-cookie="%s"></script>\n'
 
 
-@register.inclusion_tag("favorites/favorite_add_remove.html")
-def add_remove_favorite(object, user):
-    favorite = None
-    content_type = ContentType.objects.get_for_model(object)
-    if user.is_authenticated():
-        favorite = Favorite.objects.favorites_for_object(object, user=user)
-        if favorite:
-            favorite = favorite[0]
-        else:
-            favorite = None
-    count = Favorite.objects.favorites_for_object(object).count()
+def _script_once(context):
+    """Returns the ``<script>`` tag of ``favorites/js/favorites.js`` the first
+    time it's called for a request, or for a template rendering without
+    request, and an empty string afterwards."""
+    holder = context.get('request')
+    if holder is None:
+        holder = context.render_context
+        if 'favorites_script' in holder:
+            return ''
+        holder['favorites_script'] = True
+    else:
+        if getattr(holder, '_favorites_script', False):
+            return ''
+        holder._favorites_script = True
+    return SCRIPT % (settings.STATIC_URL, settings.CSRF_COOKIE_NAME)
+
+
+def _is_favorite_of(object, user):
+    """Returns True if ``object`` is a favorite of ``user``, reading the
+    favorites cache if it's enabled and looking up this favorite only
+    otherwise, rather than loading every favorite of the user."""
+    if not user.is_authenticated():
+        return False
+    if cache.get_favorites_cache() is not None:
+        return object.pk in Favorite.objects.favorited_object_ids(user, type(object))
+    return Favorite.objects.favorites_for_object(object, user=user).exists()
+
 
-    return {"object_id": object.pk,
-            "content_type_id": content_type.pk,
-            "is_favorite": favorite,
-            "count": count}
+def _render_add_remove_favorite(object, content_type_id, is_favorite, count=None):
+    if count is None:
+        count = FavoriteCount.objects.count_for_object(object)
+    return render_to_string("favorites/favorite_add_remove.html",
+                            {"object_id": object.pk,
+                             "content_type_id": content_type_id,
+                             "is_favorite": is_favorite,
+                             "count": count})
+
+
+@register.simple_tag(takes_context=True)
+def add_remove_favorite(context, object, user, favorites=None):
+    """Renders a link toggling ``object`` in the favorites of ``user`` and its
+    number of favorites.
+
+    The state and the number of favorites of the object are looked up for
+    each link, unless ``favorites`` is the result of ``favorites_for_objects``
+    for the rendered objects, which looks them up for all of them at once::
+
+        {% favorites_for_objects objects user as favs %}
+        {% for o in objects %}{% add_remove_favorite o user favs %}{% endfor %}
+
+    The script handling the links, ``favorites/js/favorites.js``, requires
+    jQuery and is included before the first link of the page.
+
+    With ``FAVORITES_FRAGMENT_CACHE``, links are cached by object and state
+    until the object is favorited or unfavorited, see :mod:`favorites.cache`.
+    """
+    content_type_id = ContentType.objects.get_for_model(object).pk
+    count = None
+    if favorites is None:
+        is_favorite = _is_favorite_of(object, user)
+    else:
+        entry = favorites.get(object.pk, {})
+        is_favorite = entry.get('is_favorite', False)
+        count = entry.get('count', 0)
+    fragment_cache = cache.get_fragment_cache()
+    if fragment_cache is None:
+        html = _render_add_remove_favorite(object, content_type_id, is_favorite, count)
+    else:
+        key = cache.fragment_key(content_type_id, object.pk, is_favorite)
+        html = fragment_cache.get(key)
+        if html is None:
+            html = _render_add_remove_favorite(object, content_type_id, is_favorite, count)
+            fragment_cache.set(key, html)
+    return mark_safe(_script_once(context) + html)
 
 
 class FavoritesForObjectsNode(Node):
@@ -139,13 +205,22 @@ def url_delete_from_favorites_confirmation(context, ns, object):
 
 @register.inclusion_tag('favorites/favorite_move_widget.html', takes_context=True)
 def favorite_move_widget(context, favorite):
-    user = context['request'].user
-    path = context['request'].path
-    choices = Folder.objects.filter(user=user).order_by('name').values_list('pk', 'name')
-    folder_id = favorite.folder.pk if favorite.folder else 0
-    form = UserFolderChoicesForm(choices=choices,
-                                 initial={'folder_id': folder_id,
-                                          'object_id': favorite.pk})
+    """Renders a form to move ``favorite`` to another folder.
+
+    User's folders are fetched once per request and forms are shared
+    by favorites of the same folder."""
+    request = context['request']
+    path = request.path
+    if not hasattr(request, '_favorite_move_forms'):
+        query = Folder.objects.filter(user=request.user).order_by('name')
+        request._favorite_folder_choices = list(query.values_list('pk', 'name'))
+        request._favorite_move_forms = {}
+    forms = request._favorite_move_forms
+    folder_id = favorite.folder_id or 0
+    if folder_id not in forms:
+        forms[folder_id] = UserFolderChoicesForm(choices=request._favorite_folder_choices,
+                                                 initial={'folder_id': folder_id})
+    form = forms[folder_id]
     return {'form': form,
             'favorite': favorite,
             'next': path,
@@ -1,13 +1,42 @@
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import StringIO
+
 from django.db import models
 from django.contrib.auth.models import User
-from django.test.client import Client
-from django.test import TestCase
+from django.test.client import Client, RequestFactory
+from django.test import TestCase, TransactionTestCase
 from django.db import models
 from django.core.urlresolvers import reverse
+from django.core.management import call_command
+from django.template import Template, Context
+from django.core.cache import get_cache
+from django.db import connection, IntegrityError
+from django.contrib.contenttypes.models import ContentType
+from django.utils.unittest import skipIf, skipUnless
 
 from models import Favorite
+from models import FavoriteCount
+from models import FavoriteBucket
+from models import FavoriteEvent
+from models import FavoriteVersion
 from models import Folder
 from managers import FavoritesManagerMixin
+from templatetags.favorites_tags import is_favorite
+from urls import urlpatterns
+import admin
+import benchmark
+import export
+import load
+import registry
+import signals
+import views
+import favorites
 
 
 class DummyModel(models.Model):
@@ -72,6 +101,27 @@ class FolderTests(BaseFavoritesTestCase):
         Folder.objects.all().delete()
         godzilla.delete()
 
+    def test_favorite_counts(self):
+        """Folders and the root pseudo-folder come with their favorite counts."""
+        godzilla = self.user('godzilla')
+        leviathan = self.user('leviathan')
+        foo = Folder.objects.create(name="foo", user=godzilla)
+        Folder.objects.create(name="bar", user=godzilla)
+        dummies = [DummyModel.objects.create() for _ in range(3)]
+        Favorite.objects.bulk_create_favorites(dummies[:2], godzilla, foo)
+        last = Favorite.objects.create_favorite(dummies[2], godzilla)
+        Favorite.objects.create_favorite(dummies[2], leviathan)
+
+        self.client.login(username='godzilla', password='godzilla')
+        response = self.client.get(reverse('favorites:folder_list'))
+        root = response.context['root']
+        self.assertIsNone(root.pk)
+        self.assertEquals((root.favorite_count, root.last_favorited_on), (1, last.created_on))
+        self.assertEquals([(f.name, f.favorite_count) for f in response.context['object_list']],
+                          [('foo', 2), ('bar', 0)])
+        with self.assertNumQueries(2):
+            Folder.objects.with_favorite_counts(godzilla)
+
     def test_login_required(self):
         """Test that ``folder_list`` url requires that the user is logged in.
 
@@ -344,6 +394,38 @@ class AddFavoriteTests(BaseFavoritesTestCase):
         folder.delete()
         dummy.delete()
 
+    def test_post_queries(self):
+        """A successful ``POST`` reads the object and user's folders only."""
+        godzilla = self.user('godzilla')
+        folder = Folder.objects.create(name='japan', user=godzilla)
+        dummy = DummyModel.objects.create()
+        # counters of the object already exist
+        Favorite.objects.create_favorite(dummy, self.user('leviathan'))
+        registry.warm()
+        request = RequestFactory().post('/', {'folder_id': folder.pk, 'next': '/'})
+        request.user = godzilla
+        with self.assertNumQueries(2 + 4):
+            # object and folders, then favorite insert, counters and version updates
+            response = views.favorite_add(request, 'favorites', 'dummymodel', dummy.pk)
+        self.assertEquals(response.status_code, 302)
+        favorite = Favorite.objects.favorites_for_object(dummy, godzilla).get()
+        self.assertEquals(favorite.folder, folder)
+
+    def test_post_already_favorite(self):
+        """Posting an object already favorited renders a message."""
+        godzilla = self.user('godzilla')
+        self.client.login(username='godzilla', password='godzilla')
+        dummy = DummyModel.objects.create()
+        Favorite.objects.create_favorite(dummy, godzilla)
+        target_url = reverse('favorites:favorite_add', kwargs={
+    'app_label': DummyModel._meta.app_label,
+    'object_name': DummyModel._meta.module_name,
+    'object_id': dummy.pk
+})
+        response = self.client.post(target_url, {'folder_id': ''})
+        self.assertTemplateUsed(response, 'favorites/favorite_already_favorite.html')
+        self.assertEquals(Favorite.objects.count(), 1)
+
     def test_invalid_permission_on_folder(self):
         """User submits a form with a folder that is not his or her, renders the form."""
         godzilla = self.user('godzilla')
@@ -693,6 +775,16 @@ class MoveFavoriteTests(BaseFavoritesTestCase):
         response = self.client.post(target_url)
         self.assertEquals(response.status_code, 302)
 
+    def test_title(self):
+        """The page names the user and the favorited object."""
+        godzilla = self.user('godzilla')
+        self.client.login(username='godzilla', password='godzilla')
+        dummy = DummyModel.objects.create()
+        favorite = Favorite.objects.create_favorite(dummy, godzilla)
+        response = self.client.get(reverse('favorites:favorite_move',
+                                           kwargs={'object_id': favorite.pk}))
+        self.assertContains(response, 'godzilla likes %s' % dummy)
+
     def test_get(self):
         """A logged in user ask to move a valid favorite."""
         godzilla = self.user('godzilla')
@@ -1105,7 +1197,503 @@ class ToggleShareFavoritesTests(TestCase):
         favorite = Favorite.objects.get(pk=favorite.pk)
         self.assertTrue(favorite.shared)
 
-"""
+
+class FavoriteCountTests(BaseFavoritesTestCase):
+    """Tests for the denormalized :class:`favorites.models.FavoriteCount`."""
+
+    def test_create_and_delete(self):
+        """Counters follow favorites creation and deletion."""
+        godzilla = self.user('godzilla')
+        leviathan = self.user('leviathan')
+        dummy = DummyModel()
+        dummy.save()
+        favorite = Favorite.objects.create_favorite(dummy, godzilla)
+        Favorite.objects.create_favorite(dummy, leviathan)
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 2)
+        favorite.delete()
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 1)
+
+    def test_unknown_object(self):
+        """An object that was never favorited has a count of 0."""
+        dummy = DummyModel()
+        dummy.save()
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 0)
+
+    def test_favorites_for_objects(self):
+        """``favorites_for_objects`` reads counts from the counters."""
+        godzilla = self.user('godzilla')
+        leviathan = self.user('leviathan')
+        dummies = [DummyModel.objects.create() for _ in range(3)]
+        Favorite.objects.create_favorite(dummies[0], godzilla)
+        Favorite.objects.create_favorite(dummies[0], leviathan)
+        Favorite.objects.create_favorite(dummies[1], leviathan)
+        results = Favorite.objects.favorites_for_objects(dummies, godzilla)
+        self.assertEquals(results[dummies[0].pk]['count'], 2)
+        self.assertTrue(results[dummies[0].pk]['is_favorite'])
+        self.assertEquals(results[dummies[1].pk]['count'], 1)
+        self.assertFalse(results[dummies[1].pk]['is_favorite'])
+        self.assertNotIn(dummies[2].pk, results)
+
+    def test_rebuild(self):
+        """``rebuild_favorite_counts`` recomputes counters from scratch."""
+        godzilla = self.user('godzilla')
+        dummy = DummyModel()
+        dummy.save()
+        Favorite.objects.create_favorite(dummy, godzilla)
+        FavoriteCount.objects.all().update(count=42)
+        call_command('rebuild_favorite_counts', verbosity=0)
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 1)
+
+    def test_folder_delete(self):
+        """Favorites deleted along with their folder leave the counters."""
+        godzilla = self.user('godzilla')
+        folder = Folder.objects.create(name='japan', user=godzilla)
+        dummy = DummyModel.objects.create()
+        Favorite.objects.create_favorite(dummy, godzilla, folder)
+        self.client.login(username='godzilla', password='godzilla')
+        self.client.post(reverse('favorites:folder_delete', args=(folder.pk,)), {'object_id': folder.pk})
+        self.assertFalse(Favorite.objects.filter(user=godzilla).exists())
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 0)
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel), [])
+
+    def test_save(self):
+        """Favorites saved directly, e.g. by the admin, are counted once."""
+        godzilla = self.user('godzilla')
+        dummy = DummyModel.objects.create()
+        favorite = Favorite(user=godzilla, content_object=dummy)
+        favorite.save()
+        favorite.save()
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 1)
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel), [(dummy, 1)])
+
+
+class IsFavoriteFilterTests(BaseFavoritesTestCase):
+    """Tests for ``is_favorite`` template filter."""
+
+    def test_one_query_per_content_type(self):
+        """Favorites are loaded once for a whole list of objects."""
+        godzilla = self.user('godzilla')
+        dummies = [DummyModel.objects.create() for _ in range(5)]
+        Favorite.objects.create_favorite(dummies[1], godzilla)
+        template = Template("{% load favorites_tags %}"
+                            "{% for o in objects %}{{ o|is_favorite:user }} {% endfor %}")
+        context = Context({'objects': dummies, 'user': godzilla})
+        with self.assertNumQueries(1):
+            output = template.render(context)
+        self.assertEquals(output.split(), ['False', 'True', 'False', 'False', 'False'])
+
+    def test_invalidated_on_create(self):
+        """Creating a favorite for a user refreshes his or her favorites."""
+        godzilla = self.user('godzilla')
+        dummy = DummyModel.objects.create()
+        self.assertFalse(is_favorite(dummy, godzilla))
+        Favorite.objects.create_favorite(dummy, godzilla)
+        self.assertTrue(is_favorite(dummy, godzilla))
+
+
+class FavoritesCacheTests(BaseFavoritesTestCase):
+    """Tests for the optional per-user favorites cache."""
+
+    def setUp(self):
+        get_cache('default').clear()
+
+    def fresh(self, user):
+        """Returns a new instance of ``user`` without memoized favorites."""
+        return User.objects.get(pk=user.pk)
+
+    def test_membership_without_sql(self):
+        """Known non favorites are answered from the cache."""
+        godzilla = self.user('godzilla')
+        dummy, other = DummyModel.objects.create(), DummyModel.objects.create()
+        Favorite.objects.create_favorite(dummy, godzilla)
+        with self.settings(FAVORITES_CACHE='default'):
+            Favorite.objects.favorited_object_ids(self.fresh(godzilla), DummyModel)
+            user = self.fresh(godzilla)
+            with self.assertNumQueries(0):
+                self.assertEquals(len(Favorite.objects.favorites_for_object(other, user)), 0)
+                self.assertRaises(Favorite.DoesNotExist,
+                                  Favorite.objects.favorite_for_user, other, user)
+            self.assertEquals(Favorite.objects.favorite_for_user(dummy, user).object_id,
+                              dummy.pk)
+
+    def test_invalidation(self):
+        """Creating or deleting a favorite drops the cached favorites."""
+        godzilla = self.user('godzilla')
+        dummy = DummyModel.objects.create()
+        with self.settings(FAVORITES_CACHE='default'):
+            self.assertFalse(is_favorite(dummy, self.fresh(godzilla)))
+            favorite = Favorite.objects.create_favorite(dummy, godzilla)
+            self.assertTrue(is_favorite(dummy, self.fresh(godzilla)))
+            favorite.delete()
+            self.assertFalse(is_favorite(dummy, self.fresh(godzilla)))
+
+    def test_folder_delete(self):
+        """Favorites deleted along with their folder are dropped from the cache."""
+        godzilla = self.user('godzilla')
+        folder = Folder.objects.create(name='japan', user=godzilla)
+        dummy = DummyModel.objects.create()
+        Favorite.objects.create_favorite(dummy, godzilla, folder)
+        with self.settings(FAVORITES_CACHE='default'):
+            self.assertTrue(is_favorite(dummy, self.fresh(godzilla)))
+            self.client.login(username='godzilla', password='godzilla')
+            self.client.post(reverse('favorites:folder_delete', args=(folder.pk,)),
+                             {'object_id': folder.pk})
+            self.assertFalse(is_favorite(dummy, self.fresh(godzilla)))
+
+    def test_user_delete(self):
+        """Deleting a user with favorites doesn't create a version for him."""
+        godzilla = self.user('godzilla')
+        Favorite.objects.create_favorite(DummyModel.objects.create(), godzilla)
+        godzilla.delete()
+        self.assertFalse(FavoriteVersion.objects.filter(user=godzilla.pk).exists())
+
+
+class IndexesTests(TransactionTestCase):
+    """Checks that manager queries use the composite indexes of ``sql/favorite.sql``.
+
+    pysqlite commits before running ``EXPLAIN``, hence a ``TransactionTestCase``."""
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return u' '.join(row[-1] for row in cursor.fetchall())
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+    def test_favorites_for_object(self):
+        """Favorites for an object are looked up by content type and object id."""
+        dummy = DummyModel.objects.create()
+        plan = self.query_plan(Favorite.objects.favorites_for_object(dummy))
+        self.assertIn('favorites_favorite_content_type_object', plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+    def test_favorites_for_objects(self):
+        """Favorites for a list of objects are looked up by content type and object id."""
+        content_type = ContentType.objects.get_for_model(DummyModel)
+        qs = Favorite.objects.filter(content_type=content_type, object_id__in=[1, 2])
+        self.assertIn('favorites_favorite_content_type_object', self.query_plan(qs))
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+    def test_content_type_and_folder(self):
+        """User's favorites in a folder for a content type."""
+        godzilla = User.objects.create(username='godzilla')
+        folder = Folder.objects.create(name='japan', user=godzilla)
+        content_type = ContentType.objects.get_for_model(DummyModel)
+        qs = Favorite.objects.filter(user=godzilla, content_type=content_type, folder=folder)
+        self.assertIn('favorites_favorite_user_content_type_folder', self.query_plan(qs))
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+    def test_folder(self):
+        """User's favorites in a folder."""
+        godzilla = User.objects.create(username='godzilla')
+        folder = Folder.objects.create(name='japan', user=godzilla)
+        qs = Favorite.objects.filter(user=godzilla, folder=folder)
+        self.assertIn('favorites_favorite_user_folder', self.query_plan(qs))
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+    def test_favorites_for_user_by_date(self):
+        """User's favorites sorted by creation date."""
+        godzilla = User.objects.create(username='godzilla')
+        qs = Favorite.objects.favorites_for_user(godzilla).order_by('-created_on')
+        plan = self.query_plan(qs)
+        self.assertIn('favorites_favorite_user_created_on', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+    def test_shared(self):
+        """Shared favorites are read from partial indexes."""
+        godzilla = User.objects.create(username='godzilla')
+        leviathan = User.objects.create(username='leviathan')
+        content_type = ContentType.objects.get_for_model(DummyModel)
+        # few shared favorites, as collected by ANALYZE
+        Favorite.objects.bulk_create([Favorite(user=user, content_type=content_type,
+                                               object_id=i, shared=not i % 10)
+                                      for i in range(50) for user in (godzilla, leviathan)])
+        connection.cursor().execute('ANALYZE')
+        self.addCleanup(connection.cursor().execute, 'DELETE FROM sqlite_stat1')
+        created_on = datetime.datetime.now()
+        plan = self.query_plan(Favorite.objects.shared_for_user(godzilla)[:10])
+        self.assertIn('favorites_favorite_shared_user_created_on', plan)
+        qs = Favorite.objects.recent_shared().filter(created_on__lt=created_on)[:10]
+        self.assertIn('favorites_favorite_shared_created_on', self.query_plan(qs))
+
+
+class FavoriteListPaginationTests(BaseFavoritesTestCase):
+    """Tests for keyset pagination of ``favorite_list`` and
+    ``favorite_content_type_list`` urls."""
+
+    def walk(self, target_url):
+        """Follows ``next_cursor`` and returns the pks of the favorites of every page."""
+        pages = []
+        response = self.client.get(target_url)
+        while True:
+            self.assertEquals(response.status_code, 200)
+            pages.append([favorite.pk for favorite in response.context['favorites']])
+            cursor = response.context['next_cursor']
+            if cursor is None:
+                return pages
+            response = self.client.get(target_url, {'cursor': cursor})
+
+    def test_favorite_list(self):
+        """User walks through his or her favorites, most recent first."""
+        godzilla = self.user('godzilla')
+        self.client.login(username='godzilla', password='godzilla')
+        favorites = [Favorite.objects.create_favorite(DummyModel.objects.create(), godzilla)
+                     for _ in range(5)]
+        with self.settings(FAVORITES_PAGE_SIZE=2):
+            pages = self.walk(reverse('favorites:favorite_list'))
+        self.assertEquals([len(page) for page in pages], [2, 2, 1])
+        self.assertEquals(sum(pages, []), [f.pk for f in reversed(favorites)])
+
+    def test_content_type_list(self):
+        """User walks through his or her favorites of a content type."""
+        godzilla = self.user('godzilla')
+        self.client.login(username='godzilla', password='godzilla')
+        favorites = [Favorite.objects.create_favorite(DummyModel.objects.create(), godzilla)
+                     for _ in range(3)]
+        Favorite.objects.create_favorite(BarModel.objects.create(), godzilla)
+        target_url = reverse('favorites:favorite_content_type_list', kwargs={
+    'app_label': DummyModel._meta.app_label,
+    'object_name': DummyModel._meta.module_name
+})
+        with self.settings(FAVORITES_PAGE_SIZE=2):
+            pages = self.walk(target_url)
+        self.assertEquals(sum(pages, []), [f.pk for f in reversed(favorites)])
+
+    def test_time_zone(self):
+        """Cursors point to the same favorite with time zone support."""
+        godzilla = self.user('godzilla')
+        self.client.login(username='godzilla', password='godzilla')
+        with self.settings(USE_TZ=True, FAVORITES_PAGE_SIZE=2):
+            favorites = [Favorite.objects.create_favorite(DummyModel.objects.create(), godzilla)
+                         for _ in range(6)]
+            pages = self.walk(reverse('favorites:favorite_list'))
+        self.assertEquals(sum(pages, []), [f.pk for f in reversed(favorites)])
+
+    def test_invalid_cursor(self):
+        """User sends a forged cursor. Returns a 400."""
+        godzilla = self.user('godzilla')
+        self.client.login(username='godzilla', password='godzilla')
+        response = self.client.get(reverse('favorites:favorite_list'), {'cursor': 'foo'})
+        self.assertEquals(response.status_code, 400)
+
+
+class WithContentObjectsTests(BaseFavoritesTestCase):
+    """Tests for ``with_content_objects`` queryset method."""
+
+    def test_one_query_per_content_type(self):
+        """Favorited objects are fetched with one query per content type."""
+        godzilla = self.user('godzilla')
+        objects = []
+        for model in (DummyModel, BarModel, DummyModel, BarModel):
+            instance = model.objects.create()
+            Favorite.objects.create_favorite(instance, godzilla)
+            objects.append(instance)
+        with self.assertNumQueries(3):
+            favorites = list(Favorite.objects.favorites_for_user(godzilla)
+                                             .order_by('pk').with_content_objects())
+            content_objects = [favorite.content_object for favorite in favorites]
+        self.assertEquals(content_objects, objects)
+
+
+class FavoriteMoveWidgetTests(BaseFavoritesTestCase):
+    """Tests for ``favorite_move_widget`` template tag."""
+
+    def test_one_query_per_request(self):
+        """User's folders are fetched once for all the rendered favorites."""
+        godzilla = self.user('godzilla')
+        japan = Folder.objects.create(name='japan', user=godzilla)
+        Folder.objects.create(name='china', user=godzilla)
+        favorites = [Favorite.objects.create_favorite(DummyModel.objects.create(), godzilla, folder)
+                     for folder in (None, japan, japan, None)]
+        request = RequestFactory().get('/favorites/')
+        request.user = godzilla
+        template = Template("{% load favorites_tags %}"
+                            "{% for favorite in favorites %}{% favorite_move_widget favorite %}{% endfor %}")
+        with self.assertNumQueries(1):
+            output = template.render(Context({'request': request, 'favorites': favorites}))
+        self.assertEquals(output.count('<select'), 4)
+        self.assertEquals(output.count('selected="selected">japan'), 2)
+
+
+class BulkFavoritesTests(BaseFavoritesTestCase):
+    """Tests for ``bulk_create_favorites`` and ``bulk_remove_favorites``."""
+
+    def test_bulk_create(self):
+        """Favorites are created for every object that is not already a favorite."""
+        godzilla = self.user('godzilla')
+        leviathan = self.user('leviathan')
+        japan = Folder.objects.create(name='japan', user=godzilla)
+        dummies = [DummyModel.objects.create() for _ in range(3)]
+        bar = BarModel.objects.create()
+        Favorite.objects.create_favorite(dummies[0], godzilla)
+        Favorite.objects.create_favorite(dummies[1], leviathan)
+        created = Favorite.objects.bulk_create_favorites(dummies + [bar], godzilla, japan)
+        self.assertEquals(created, 3)
+        self.assertEquals(Favorite.objects.favorites_for_user(godzilla).count(), 4)
+        self.assertEquals(Favorite.objects.filter(user=godzilla, folder=japan).count(), 3)
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummies[0]), 1)
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummies[1]), 2)
+        self.assertEquals(FavoriteCount.objects.count_for_object(bar), 1)
+        self.assertEquals(Favorite.objects.bulk_create_favorites(dummies, godzilla), 0)
+
+    def test_bulk_remove(self):
+        """Favorites of the user are removed for every object."""
+        godzilla = self.user('godzilla')
+        leviathan = self.user('leviathan')
+        dummies = [DummyModel.objects.create() for _ in range(3)]
+        Favorite.objects.bulk_create_favorites(dummies[:2], godzilla)
+        Favorite.objects.create_favorite(dummies[0], leviathan)
+        removed = Favorite.objects.bulk_remove_favorites(dummies, godzilla)
+        self.assertEquals(removed, 2)
+        self.assertEquals(Favorite.objects.favorites_for_user(godzilla).count(), 0)
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummies[0]), 1)
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummies[1]), 0)
+        self.assertFalse(is_favorite(dummies[0], godzilla))
+
+    def test_bulk_remove_selects_once(self):
+        """Removed favorites are selected once, not again to be deleted."""
+        godzilla = self.user('godzilla')
+        dummies = [DummyModel.objects.create() for _ in range(2)]
+        Favorite.objects.bulk_create_favorites(dummies, godzilla)
+        connection.use_debug_cursor = True
+        try:
+            connection.queries = []
+            Favorite.objects.bulk_remove_favorites(dummies, godzilla)
+            selects = [query['sql'] for query in connection.queries
+                       if query['sql'].startswith('SELECT') and
+                       'FROM "favorites_favorite"' in query['sql']]
+        finally:
+            connection.use_debug_cursor = None
+        self.assertEquals(len(selects), 1)
+
+    def test_bulk_remove_queries(self):
+        """The number of queries doesn't depend on the number of removed favorites."""
+        godzilla = self.user('godzilla')
+        dummies = [DummyModel.objects.create() for _ in range(12)]
+        Favorite.objects.bulk_create_favorites(dummies, godzilla)
+        connection.use_debug_cursor = True
+        try:
+            counts = []
+            for batch in (dummies[:2], dummies[2:]):
+                connection.queries = []
+                Favorite.objects.bulk_remove_favorites(batch, godzilla)
+                counts.append(len(connection.queries))
+        finally:
+            connection.use_debug_cursor = None
+        self.assertEquals(counts[0], counts[1])
+        self.assertEquals(Favorite.objects.favorites_for_user(godzilla).count(), 0)
+
+
+class AjaxFavoriteTests(BaseFavoritesTestCase):
+    """Tests for ``favorite_ajax_add``, ``favorite_ajax_remove`` and
+    ``favorite_toggle`` urls."""
+
+    def setUp(self):
+        self.godzilla = self.user('godzilla')
+        self.dummy = DummyModel.objects.create()
+        self.content_type = ContentType.objects.get_for_model(DummyModel)
+        self.data = {'content_type_id': self.content_type.pk, 'object_id': self.dummy.pk}
+
+    def test_login_required(self):
+        """User should be logged in."""
+        response = self.client.post(reverse('favorites:favorite_ajax_add'), self.data)
+        self.assertEquals(response.status_code, 302)
+
+    def test_post_required(self):
+        """Adding or removing should be a POST request."""
+        self.client.login(username='godzilla', password='godzilla')
+        response = self.client.get(reverse('favorites:favorite_ajax_add'), self.data)
+        self.assertEquals(response.status_code, 405)
+
+    def test_add_remove(self):
+        """User adds then removes a favorite, returns its state as JSON."""
+        self.client.login(username='godzilla', password='godzilla')
+        response = self.client.post(reverse('favorites:favorite_ajax_add'), self.data)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content), {'is_favorite': True, 'count': 1})
+        # adding twice is harmless
+        response = self.client.post(reverse('favorites:favorite_ajax_add'), self.data)
+        self.assertEquals(json.loads(response.content), {'is_favorite': True, 'count': 1})
+        response = self.client.post(reverse('favorites:favorite_ajax_remove'), self.data)
+        self.assertEquals(json.loads(response.content), {'is_favorite': False, 'count': 0})
+        self.assertEquals(Favorite.objects.favorites_for_user(self.godzilla).count(), 0)
+
+    def test_unknown_object(self):
+        """User try to favorite an unknown object or content type. Returns a 400."""
+        self.client.login(username='godzilla', password='godzilla')
+        for data in ({'content_type_id': self.content_type.pk, 'object_id': 0},
+                     {'content_type_id': 0, 'object_id': self.dummy.pk},
+                     {}):
+            response = self.client.post(reverse('favorites:favorite_ajax_add'), data)
+            self.assertEquals(response.status_code, 400)
+
+    def test_toggle(self):
+        """User toggles a favorite twice."""
+        self.client.login(username='godzilla', password='godzilla')
+        target_url = reverse('favorites:favorite_toggle', kwargs=self.data)
+        response = self.client.post(target_url)
+        self.assertEquals(json.loads(response.content), {'is_favorite': True, 'count': 1})
+        response = self.client.post(target_url)
+        self.assertEquals(json.loads(response.content), {'is_favorite': False, 'count': 0})
+
+    def test_toggle_get(self):
+        """Without javascript, toggle redirects to the confirmation pages."""
+        self.client.login(username='godzilla', password='godzilla')
+        target_url = reverse('favorites:favorite_toggle', kwargs=self.data)
+        kwargs = {'app_label': DummyModel._meta.app_label,
+                  'object_name': DummyModel._meta.module_name,
+                  'object_id': self.dummy.pk}
+        response = self.client.get(target_url, {'next': '/'})
+        self.assertRedirects(response, reverse('favorites:favorite_add', kwargs=kwargs) + '?next=/')
+        Favorite.objects.create_favorite(self.dummy, self.godzilla)
+        response = self.client.get(target_url, {'next': '/'})
+        self.assertEquals(response['Location'],
+                          'http://testserver%s?next=/' % reverse('favorites:favorite_delete_for_object',
+                                                                 kwargs=kwargs))
+
+    def test_add_remove_favorite_tag(self):
+        """``add_remove_favorite`` renders links to the ajax urls."""
+        Favorite.objects.create_favorite(self.dummy, self.godzilla)
+        template = Template("{% load favorites_tags %}{% add_remove_favorite object user %}")
+        output = template.render(Context({'object': self.dummy, 'user': self.godzilla}))
+        self.assertIn(reverse('favorites:favorite_toggle', kwargs=self.data), output)
+        self.assertIn(reverse('favorites:favorite_ajax_remove'), output)
+        self.assertIn('class="has-favorite"', output)
+
+
+    def test_add_remove_favorite_tag_batched(self):
+        """With the result of ``favorites_for_objects``, links are rendered
+        without queries per object."""
+        other = DummyModel.objects.create()
+        Favorite.objects.create_favorite(self.dummy, self.godzilla)
+        template = Template("{% load favorites_tags %}"
+                            "{% favorites_for_objects objects user as favs %}"
+                            "{% for o in objects %}{% add_remove_favorite o user favs %}{% endfor %}")
+        with self.assertNumQueries(2):
+            output = template.render(Context({'objects': [self.dummy, other],
+                                              'user': self.godzilla}))
+        self.assertEquals(output.count('class="has-favorite"'), 1)
+        self.assertIn('id="count-%s-%s">1<' % (self.data['content_type_id'], self.dummy.pk),
+                      output)
+        self.assertIn('id="count-%s-%s">0<' % (self.data['content_type_id'], other.pk), output)
+
+class BenchmarkTests(TestCase):
+    """Runs :mod:`favorites.benchmark` with small volumes, query counts
+    should not exceed recorded baselines."""
+
+    def test_benchmark(self):
+        users = benchmark.seed(users=2, folders=2, favorites=30)
+        report = benchmark.run(users[0])
+        self.assertEquals(benchmark.regressions(report, benchmark.load_baselines()), [])
+
+    def test_every_url_is_measured(self):
+        """Every view of ``favorites.urls`` has a baseline."""
+        baselines = benchmark.load_baselines()
+        for pattern in urlpatterns:
+            self.assertIn('view:%s' % pattern.name, baselines)
+
+
 class AnimalManager(models.Manager, FavoritesManagerMixin):
     pass
 
@@ -1118,25 +1706,834 @@ class Animal(models.Model):
     def __unicode__(self):
         return self.name
 
-class FavoritesMixinTestCase(BaseFavoriteTestCase):
-    def testWithFavorites(self):
-        alice = self.users['alice']
-        chris = self.users['chris']
-        animals = {}
-        for a in ['zebra', 'donkey', 'horse']:
-            ani = Animal(name=a)
-            ani.save()
-            animals[a] = ani
 
-        Favorite.objects.create_favorite(alice, animals['zebra'])
-        Favorite.objects.create_favorite(chris, animals['donkey'])
+class FavoritesMixinTestCase(BaseFavoritesTestCase):
+    """Tests for ``with_favorite_for`` of :class:`favorites.managers.FavoritesManagerMixin`."""
 
-        zebra = Animal.objects.with_favorite_for(alice).get(name='zebra')
-        self.assertEquals(zebra.favorite__favorite, 1)
-
-        all_animals = Animal.objects.with_favorite_for(alice).all()
+    def setUp(self):
+        self.alice = self.user('alice')
+        self.chris = self.user('chris')
+        self.animals = {}
+        for name in ['zebra', 'donkey', 'horse']:
+            self.animals[name] = Animal.objects.create(name=name)
+        Favorite.objects.create_favorite(self.animals['zebra'], self.alice)
+        Favorite.objects.create_favorite(self.animals['zebra'], self.chris)
+        Favorite.objects.create_favorite(self.animals['donkey'], self.chris)
+
+    def test_with_favorites(self):
+        """Every object is returned with its favorite flag."""
+        zebra = Animal.objects.with_favorite_for(self.alice).get(name='zebra')
+        self.assertTrue(zebra.favorite__favorite)
+        donkey = Animal.objects.with_favorite_for(self.alice).get(name='donkey')
+        self.assertFalse(donkey.favorite__favorite)
+        all_animals = Animal.objects.with_favorite_for(self.alice).all()
         self.assertEquals(len(all_animals), 3)
 
-        favorite_animals = Animal.objects.with_favorite_for(alice, all=False).all()
-        self.assertEquals(len(favorite_animals), 1)
-"""
+    def test_favorites_only(self):
+        """Only favorites are returned if ``all`` is False."""
+        favorite_animals = Animal.objects.with_favorite_for(self.chris, all=False)
+        self.assertEquals(sorted(a.name for a in favorite_animals), ['donkey', 'zebra'])
+        for animal in favorite_animals:
+            self.assertTrue(animal.favorite__favorite)
+
+    def test_count(self):
+        """Favorites counts are added in the same query."""
+        with self.assertNumQueries(1):
+            animals = dict((a.name, a) for a in Animal.objects.with_favorite_for(self.alice, count=True))
+        self.assertEquals(animals['zebra'].favorite__count, 2)
+        self.assertEquals(animals['donkey'].favorite__count, 1)
+        self.assertEquals(animals['horse'].favorite__count, 0)
+        self.assertFalse(animals['donkey'].favorite__favorite)
+
+
+class RegistryTests(BaseFavoritesTestCase):
+    """Tests for :mod:`favorites.registry`."""
+
+    def tearDown(self):
+        super(RegistryTests, self).tearDown()
+        registry.reset()
+
+    def test_lookup_without_query(self):
+        """Once loaded, models are resolved without queries."""
+        registry.warm()
+        content_type = ContentType.objects.get_for_model(DummyModel)
+        with self.assertNumQueries(0):
+            options = registry.get_by_name('favorites', 'dummymodel')
+            self.assertEquals((options.model, options.content_type_id),
+                              (DummyModel, content_type.pk))
+            options = registry.get_by_content_type_id(content_type.pk)
+            self.assertEquals((options.model, options.content_type_id),
+                              (DummyModel, content_type.pk))
+            self.assertIsNone(registry.get_by_name('foo', 'bar'))
+            self.assertIsNone(registry.get_by_content_type_id('foo'))
+
+    def test_declared_models(self):
+        """Only models of ``FAVORITES_MODELS`` are favoritable."""
+        godzilla = self.user('godzilla')
+        self.client.login(username='godzilla', password='godzilla')
+        bar = BarModel.objects.create()
+        target_url = reverse('favorites:favorite_add', kwargs={
+    'app_label': BarModel._meta.app_label,
+    'object_name': BarModel._meta.module_name,
+    'object_id': bar.pk
+})
+        with self.settings(FAVORITES_MODELS=['favorites.DummyModel']):
+            registry.reset()
+            self.assertIsNone(registry.get_by_name('favorites', 'barmodel'))
+            response = self.client.get(target_url)
+            self.assertEquals(response.status_code, 400)
+
+    def test_register(self):
+        """Registered models are favoritable along with declared ones."""
+        with self.settings(FAVORITES_MODELS=['favorites.DummyModel']):
+            favorites.register(BarModel, cache_ttl=60, select_related=['foo'])
+            try:
+                options = registry.get_by_name('favorites', 'barmodel')
+                self.assertEquals(options.model, BarModel)
+                self.assertEquals(options.cache_ttl, 60)
+                self.assertEquals(options.select_related, ('foo',))
+                self.assertIsNotNone(registry.get_by_name('favorites', 'dummymodel'))
+            finally:
+                favorites.unregister(BarModel)
+            self.assertIsNone(registry.get_by_name('favorites', 'barmodel'))
+
+    def test_register_keeps_installed_models(self):
+        """Without ``FAVORITES_MODELS``, registering a model doesn't make
+        other installed models unfavoritable."""
+        self.user('godzilla')
+        self.client.login(username='godzilla', password='godzilla')
+        bar = BarModel.objects.create()
+        target_url = reverse('favorites:favorite_add', kwargs={
+    'app_label': BarModel._meta.app_label,
+    'object_name': BarModel._meta.module_name,
+    'object_id': bar.pk
+})
+        favorites.register(DummyModel, counter=False)
+        try:
+            self.assertIsNotNone(registry.get_by_name('favorites', 'barmodel'))
+            response = self.client.get(target_url)
+            self.assertNotEquals(response.status_code, 400)
+        finally:
+            favorites.unregister(DummyModel)
+
+    def test_without_counter(self):
+        """Models registered with ``counter=False`` are counted on the fly."""
+        godzilla = self.user('godzilla')
+        hulk = self.user('hulk')
+        dummy = DummyModel.objects.create()
+        favorites.register(DummyModel, counter=False)
+        try:
+            Favorite.objects.create_favorite(dummy, godzilla)
+            Favorite.objects.bulk_create_favorites([dummy], hulk)
+            self.assertEquals(FavoriteCount.objects.count(), 0)
+            self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 2)
+            results = Favorite.objects.favorites_for_objects([dummy], godzilla)
+            self.assertEquals(results[dummy.pk]['count'], 2)
+            Favorite.objects.favorites_for_object(dummy, hulk).delete()
+            self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 1)
+        finally:
+            favorites.unregister(DummyModel)
+
+
+class MostFavoritedTests(BaseFavoritesTestCase):
+    """Tests for :meth:`favorites.managers.FavoriteManager.most_favorited`."""
+
+    def setUp(self):
+        super(MostFavoritedTests, self).setUp()
+        self.users = [self.user(name) for name in ('godzilla', 'leviathan', 'hulk')]
+        self.dummies = [DummyModel.objects.create() for _ in range(3)]
+
+    def age(self, days):
+        """Moves every favorite ``days`` days back and rebuilds buckets."""
+        created_on = datetime.datetime.now() - datetime.timedelta(days=days)
+        Favorite.objects.all().update(created_on=created_on)
+        FavoriteBucket.objects.rebuild()
+
+    def test_ranking(self):
+        """Objects are ranked by their number of favorites."""
+        first, second, third = self.dummies
+        for user in self.users:
+            Favorite.objects.create_favorite(second, user)
+        Favorite.objects.bulk_create_favorites([first, third], self.users[0])
+        Favorite.objects.create_favorite(third, self.users[1])
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel),
+                          [(second, 3), (third, 2), (first, 1)])
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel, limit=1),
+                          [(second, 3)])
+
+    def test_removal(self):
+        """Removed favorites are removed from their bucket."""
+        first, second, _ = self.dummies
+        favorite = Favorite.objects.create_favorite(first, self.users[0])
+        Favorite.objects.bulk_create_favorites([first, second], self.users[1])
+        favorite.delete()
+        Favorite.objects.bulk_remove_favorites([second], self.users[1])
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel), [(first, 1)])
+
+    def test_since(self):
+        """Only favorites created since the given day are counted."""
+        first, second, _ = self.dummies
+        Favorite.objects.create_favorite(first, self.users[0])
+        Favorite.objects.create_favorite(first, self.users[1])
+        self.age(10)
+        Favorite.objects.create_favorite(second, self.users[0])
+        week_ago = datetime.datetime.now() - datetime.timedelta(days=7)
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel, since=week_ago),
+                          [(second, 1)])
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel),
+                          [(first, 2), (second, 1)])
+        # the old favorite is removed from its own bucket
+        Favorite.objects.favorites_for_object(first, self.users[0]).get().delete()
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel),
+                          [(first, 1), (second, 1)])
+
+    def test_reads_buckets(self):
+        """Leaderboards are read from buckets, not from favorites."""
+        Favorite.objects.create_favorite(self.dummies[0], self.users[0])
+        FavoriteBucket.objects.all().update(count=42)
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel),
+                          [(self.dummies[0], 42)])
+        call_command('rebuild_favorite_counts', verbosity=0)
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel),
+                          [(self.dummies[0], 1)])
+
+    def test_without_counter(self):
+        """Models registered with ``counter=False`` are ranked from favorites."""
+        favorites.register(DummyModel, counter=False)
+        try:
+            Favorite.objects.create_favorite(self.dummies[1], self.users[0])
+            self.assertEquals(FavoriteBucket.objects.count(), 0)
+            self.assertEquals(Favorite.objects.most_favorited(DummyModel),
+                              [(self.dummies[1], 1)])
+        finally:
+            favorites.unregister(DummyModel)
+
+
+class ExportTests(BaseFavoritesTestCase):
+    """Tests for :mod:`favorites.export`."""
+
+    def setUp(self):
+        super(ExportTests, self).setUp()
+        self.godzilla = self.user('godzilla')
+        self.folder = Folder.objects.create(user=self.godzilla, name=u'caf\xe9')
+        self.dummies = [DummyModel.objects.create() for _ in range(3)]
+        Favorite.objects.create_favorite(self.dummies[0], self.godzilla, self.folder)
+        Favorite.objects.bulk_create_favorites(self.dummies[1:], self.godzilla)
+        Favorite.objects.create_favorite(self.godzilla, self.godzilla)
+
+    def test_ndjson(self):
+        """Every favorite is exported, in creation order."""
+        lines = list(export.export(self.godzilla, 'ndjson', chunk_size=2))
+        favorites = [json.loads(line) for line in lines]
+        self.assertEquals([f['object_id'] for f in favorites],
+                          [d.pk for d in self.dummies] + [self.godzilla.pk])
+        self.assertEquals(favorites[0]['content_type'], 'favorites.dummymodel')
+        self.assertEquals(favorites[0]['folder'], u'caf\xe9')
+        self.assertEquals(favorites[3]['object'], u'godzilla')
+
+    def test_bounded_queries(self):
+        """Labels are resolved once per content type and chunk."""
+        with self.assertNumQueries(4):
+            # one chunk with dummies and a user, then the end of favorites
+            list(export.export(self.godzilla, 'ndjson', chunk_size=10))
+        with self.assertNumQueries(5):
+            # a chunk of dummies, a chunk with the user, then the end
+            list(export.export(self.godzilla, 'ndjson', chunk_size=3))
+
+    def test_csv(self):
+        """CSV exports start with a header and are UTF-8 encoded."""
+        lines = ''.join(export.export(self.godzilla, 'csv')).splitlines()
+        self.assertEquals(lines[0], ','.join(export.FIELDS))
+        self.assertEquals(len(lines), 5)
+        self.assertIn(u'caf\xe9'.encode('utf-8'), lines[1])
+
+    def test_view(self):
+        """The export view streams an attachment of the current user's favorites."""
+        self.client.login(username='godzilla', password='godzilla')
+        url = reverse('favorites:favorite_export')
+        response = self.client.get(url, {'format': 'csv'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'text/csv')
+        self.assertEquals(len(response.content.splitlines()), 5)
+        response = self.client.get(url)
+        self.assertEquals(len(response.content.splitlines()), 4)
+        self.assertEquals(self.client.get(url, {'format': 'xml'}).status_code, 400)
+
+    def test_command(self):
+        """``export_favorites`` writes the favorites of a user."""
+        out = StringIO.StringIO()
+        call_command('export_favorites', 'godzilla', format='csv', stdout=out)
+        self.assertEquals(len(out.getvalue().splitlines()), 5)
+
+
+class LoadTests(BaseFavoritesTestCase):
+    """Tests for :mod:`favorites.load`."""
+
+    def setUp(self):
+        super(LoadTests, self).setUp()
+        self.godzilla = self.user('godzilla')
+        self.hulk = self.user('hulk')
+        self.dummies = [DummyModel.objects.create() for _ in range(3)]
+
+    def record(self, dummy, **kwargs):
+        return dict({'content_type': 'favorites.dummymodel', 'object_id': dummy.pk}, **kwargs)
+
+    def test_load(self):
+        """Valid records are created, duplicates and invalid ones are skipped."""
+        Favorite.objects.create_favorite(self.dummies[0], self.godzilla)
+        records = [self.record(self.dummies[0]),
+                   self.record(self.dummies[1], folder=u'caf\xe9', shared='true',
+                               created_on='2012-01-02T03:04:05'),
+                   self.record(self.dummies[1]),
+                   self.record(self.dummies[1], user='hulk'),
+                   self.record(self.dummies[2], user='nobody'),
+                   {'content_type': 'foo.bar', 'object_id': 1},
+                   {'content_type': 'favorites.dummymodel', 'object_id': 0}]
+        stats = load.load(records, self.godzilla, batch_size=3)
+        self.assertEquals(stats, {'read': 7, 'created': 2, 'duplicate': 2, 'invalid': 3})
+        favorite = Favorite.objects.favorites_for_object(self.dummies[1], self.godzilla).get()
+        self.assertEquals(favorite.folder.name, u'caf\xe9')
+        self.assertEquals(favorite.folder.user, self.godzilla)
+        self.assertTrue(favorite.shared)
+        self.assertEquals(favorite.created_on, datetime.datetime(2012, 1, 2, 3, 4, 5))
+        self.assertEquals(FavoriteCount.objects.count_for_object(self.dummies[1]), 2)
+        self.assertEquals(Favorite.objects.most_favorited(DummyModel, limit=1),
+                          [(self.dummies[1], 2)])
+
+    def test_batched_queries(self):
+        """Queries are per batch, not per record."""
+        records = [self.record(dummy, user=user.username)
+                   for dummy in self.dummies for user in (self.godzilla, self.hulk)]
+        registry.warm()
+        with self.assertNumQueries(4 + 3 + 3 + 4):
+            # users, objects, existing favorites and insert, then lookup,
+            # update and insert of counters and of buckets, then update
+            # and insert of both users versions
+            load.load(records)
+        self.assertEquals(Favorite.objects.count(), 6)
+
+    def test_invalid_date(self):
+        """Records with an out of range date are invalid."""
+        records = [self.record(self.dummies[0], created_on='2013-02-30T00:00:00'),
+                   self.record(self.dummies[1], created_on='2013-02-28T00:00:00')]
+        stats = load.load(records, self.godzilla)
+        self.assertEquals(stats, {'read': 2, 'created': 1, 'duplicate': 0, 'invalid': 1})
+
+    def test_short_csv_row(self):
+        """CSV rows with missing or extra fields are invalid."""
+        f = StringIO.StringIO('content_type,object_id,folder\r\n'
+                              'favorites.dummymodel,%s\r\n'
+                              'favorites.dummymodel,%s,monsters,extra\r\n'
+                              'favorites.dummymodel,%s,monsters\r\n'
+                              % tuple(dummy.pk for dummy in self.dummies))
+        stats = load.load(load.read_csv(f), self.godzilla)
+        self.assertEquals(stats, {'read': 3, 'created': 1, 'duplicate': 0, 'invalid': 2})
+
+    def test_export_and_load(self):
+        """The output of an export can be loaded back."""
+        folder = Folder.objects.create(user=self.godzilla, name='monsters')
+        Favorite.objects.create_favorite(self.dummies[0], self.godzilla, folder)
+        Favorite.objects.create_favorite(self.dummies[1], self.godzilla)
+        for format in ('ndjson', 'csv'):
+            path = os.path.join(tempfile.mkdtemp(), 'favorites.%s' % format)
+            with open(path, 'wb') as f:
+                f.writelines(export.export(self.godzilla, format))
+            out = StringIO.StringIO()
+            call_command('load_favorites', path, user='hulk', stdout=out)
+            self.assertIn('2 records read', out.getvalue())
+            favorites = Favorite.objects.favorites_for_user(self.hulk)
+            self.assertEquals(sorted(favorites.values_list('object_id', 'folder__name')),
+                              [(self.dummies[0].pk, 'monsters'), (self.dummies[1].pk, None)])
+            shutil.rmtree(os.path.dirname(path))
+
+
+class SignalsTests(BaseFavoritesTestCase):
+    """Tests for :mod:`favorites.signals`."""
+
+    def setUp(self):
+        super(SignalsTests, self).setUp()
+        self.received = []
+        for name, signal in signals.SIGNALS.items():
+            signal.connect(self.receiver, dispatch_uid='tests-%s' % name)
+        self.godzilla = self.user('godzilla')
+        self.folder = Folder.objects.create(user=self.godzilla, name='monsters')
+        self.dummies = [DummyModel.objects.create() for _ in range(2)]
+
+    def tearDown(self):
+        super(SignalsTests, self).tearDown()
+        for name, signal in signals.SIGNALS.items():
+            signal.disconnect(dispatch_uid='tests-%s' % name)
+
+    def receiver(self, signal, sender, favorite, **kwargs):
+        self.received.append((signal, favorite.object_id, kwargs))
+
+    def test_signals(self):
+        """Each change sends its signal."""
+        favorite = Favorite.objects.create_favorite(self.dummies[0], self.godzilla)
+        favorite.move(self.folder)
+        favorite.toggle_share()
+        favorite.delete()
+        pk = self.dummies[0].pk
+        self.assertEquals(self.received,
+                          [(signals.favorite_added, pk, {}),
+                           (signals.favorite_moved, pk, {'old_folder': None}),
+                           (signals.favorite_shared_toggled, pk, {}),
+                           (signals.favorite_removed, pk, {})])
+
+    def test_bulk_signals(self):
+        """Bulk changes send a signal per favorite."""
+        Favorite.objects.bulk_create_favorites(self.dummies, self.godzilla)
+        Favorite.objects.bulk_remove_favorites(self.dummies, self.godzilla)
+        self.assertEquals(sorted((s, pk) for s, pk, _ in self.received),
+                          sorted([(signals.favorite_added, d.pk) for d in self.dummies] +
+                                 [(signals.favorite_removed, d.pk) for d in self.dummies]))
+
+    def test_views(self):
+        """Views moving and sharing favorites send signals."""
+        favorite = Favorite.objects.create_favorite(self.dummies[0], self.godzilla)
+        self.client.login(username='godzilla', password='godzilla')
+        self.client.post(reverse('favorites:favorite_move', args=(favorite.pk,)),
+                         {'folder_id': self.folder.pk})
+        self.client.post(reverse('favorites:favorite_toggle_share', args=(favorite.pk,)),
+                         {})
+        self.assertEquals([s for s, _, _ in self.received],
+                          [signals.favorite_added, signals.favorite_moved,
+                           signals.favorite_shared_toggled])
+        self.assertEquals(self.received[1][2]['old_folder'], None)
+
+    def test_outbox(self):
+        """Changes are written to the outbox when it's enabled."""
+        Favorite.objects.create_favorite(self.dummies[0], self.godzilla)
+        self.assertEquals(FavoriteEvent.objects.count(), 0)
+        with self.settings(FAVORITES_OUTBOX=True):
+            favorite = Favorite.objects.create_favorite(self.dummies[1], self.godzilla)
+            favorite.move(self.folder)
+            Favorite.objects.bulk_remove_favorites(self.dummies, self.godzilla)
+        events = FavoriteEvent.objects.after(0)
+        self.assertEquals([(e.event, e.object_id, e.folder_id) for e in events[:2]],
+                          [('added', self.dummies[1].pk, None),
+                           ('moved', self.dummies[1].pk, self.folder.pk)])
+        # removed favorites are selected in no particular order
+        self.assertEquals(sorted((e.event, e.object_id, e.folder_id) for e in events[2:]),
+                          [('removed', self.dummies[0].pk, None),
+                           ('removed', self.dummies[1].pk, self.folder.pk)])
+        self.assertEquals(list(FavoriteEvent.objects.after(events[2].pk)), [events[3]])
+
+    def test_folder_delete(self):
+        """Favorites deleted along with their folder are removed from the outbox."""
+        Favorite.objects.create_favorite(self.dummies[0], self.godzilla, self.folder)
+        with self.settings(FAVORITES_OUTBOX=True):
+            self.folder.delete()
+        self.assertEquals(self.received[-1], (signals.favorite_removed, self.dummies[0].pk, {}))
+        self.assertEquals([(e.event, e.object_id) for e in FavoriteEvent.objects.after(0)],
+                          [('removed', self.dummies[0].pk)])
+
+
+class OutboxTransactionTests(TransactionTestCase):
+    """Changes and their events are committed together."""
+
+    def failing_receiver(self, **kwargs):
+        raise RuntimeError
+
+    def test_rollback(self):
+        godzilla = User.objects.create(username='godzilla')
+        dummy = DummyModel.objects.create()
+        signals.favorite_added.connect(self.failing_receiver, dispatch_uid='tests-fail')
+        try:
+            with self.settings(FAVORITES_OUTBOX=True):
+                self.assertRaises(RuntimeError, Favorite.objects.create_favorite, dummy, godzilla)
+                self.assertRaises(RuntimeError, Favorite.objects.get_or_create_favorite,
+                                  dummy, godzilla)
+        finally:
+            signals.favorite_added.disconnect(dispatch_uid='tests-fail')
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 0)
+
+
+class CacheTransactionTests(TransactionTestCase):
+    """Caches are dropped once changes are committed."""
+
+    def setUp(self):
+        get_cache('default').clear()
+
+    def test_invalidate_after_commit(self):
+        godzilla = User.objects.create(username='godzilla')
+        dummy = DummyModel.objects.create()
+        content_type = ContentType.objects.get_for_model(DummyModel)
+
+        def stale_receiver(**kwargs):
+            # a concurrent request caching favorites before the commit
+            favorites.cache.set_object_ids(godzilla.pk, content_type.pk, set())
+        signals.favorite_added.connect(stale_receiver, dispatch_uid='tests-stale')
+        try:
+            with self.settings(FAVORITES_CACHE='default'):
+                Favorite.objects.create_favorite(dummy, godzilla)
+                self.assertIsNone(favorites.cache.get_object_ids(godzilla.pk, content_type.pk))
+        finally:
+            signals.favorite_added.disconnect(dispatch_uid='tests-stale')
+
+    def test_bump_after_commit(self):
+        godzilla = User.objects.create(username='godzilla')
+        dummy = DummyModel.objects.create()
+        content_type = ContentType.objects.get_for_model(DummyModel)
+        versions = []
+
+        def stale_receiver(**kwargs):
+            # a concurrent request rendering the object before the commit
+            versions.append(favorites.cache.object_version(content_type.pk, dummy.pk))
+        signals.favorite_added.connect(stale_receiver, dispatch_uid='tests-stale')
+        try:
+            with self.settings(FAVORITES_FRAGMENT_CACHE='default'):
+                Favorite.objects.create_favorite(dummy, godzilla)
+                self.assertNotEquals(favorites.cache.object_version(content_type.pk, dummy.pk),
+                                     versions[0])
+        finally:
+            signals.favorite_added.disconnect(dispatch_uid='tests-stale')
+
+
+class SharedFavoritesTests(BaseFavoritesTestCase):
+    """Tests for shared favorites listing."""
+
+    def setUp(self):
+        super(SharedFavoritesTests, self).setUp()
+        self.godzilla = self.user('godzilla')
+        self.leviathan = self.user('leviathan')
+        self.dummies = [DummyModel.objects.create() for _ in range(4)]
+        for i, dummy in enumerate(self.dummies):
+            for user in (self.godzilla, self.leviathan):
+                favorite = Favorite.objects.create_favorite(dummy, user)
+                if i % 2:
+                    favorite.toggle_share()
+
+    def test_managers(self):
+        """Only shared favorites are returned, most recent first."""
+        shared = Favorite.objects.shared_for_user(self.godzilla)
+        self.assertEquals([f.object_id for f in shared],
+                          [self.dummies[3].pk, self.dummies[1].pk])
+        recent = Favorite.objects.recent_shared()
+        self.assertEquals([(f.user, f.object_id) for f in recent],
+                          [(self.leviathan, self.dummies[3].pk), (self.godzilla, self.dummies[3].pk),
+                           (self.leviathan, self.dummies[1].pk), (self.godzilla, self.dummies[1].pk)])
+
+    def test_views(self):
+        """Shared favorites are public and paginated."""
+        url = reverse('favorites:favorite_shared_list_for_user', kwargs={'username': 'godzilla'})
+        with self.settings(FAVORITES_PAGE_SIZE=1):
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(response.context['owner'], self.godzilla)
+            self.assertEquals([f.object_id for f in response.context['favorites']],
+                              [self.dummies[3].pk])
+            response = self.client.get(url, {'cursor': response.context['next_cursor']})
+            self.assertEquals([f.object_id for f in response.context['favorites']],
+                              [self.dummies[1].pk])
+        response = self.client.get(reverse('favorites:favorite_shared_list'))
+        self.assertEquals(len(response.context['favorites']), 4)
+        url = reverse('favorites:favorite_shared_list_for_user', kwargs={'username': 'nobody'})
+        self.assertEquals(self.client.get(url).status_code, 404)
+
+
+class GetOrCreateFavoriteTests(BaseFavoritesTestCase):
+    """Tests for :meth:`favorites.managers.FavoriteManager.get_or_create_favorite`."""
+
+    def setUp(self):
+        super(GetOrCreateFavoriteTests, self).setUp()
+        self.godzilla = self.user('godzilla')
+        self.dummy = DummyModel.objects.create()
+
+    def test_idempotent(self):
+        """The favorite is created once, then returned."""
+        favorite, created = Favorite.objects.get_or_create_favorite(self.dummy, self.godzilla)
+        self.assertTrue(created)
+        self.assertIsNotNone(favorite.pk)
+        again, created = Favorite.objects.get_or_create_favorite(self.dummy, self.godzilla)
+        self.assertFalse(created)
+        self.assertEquals(again.pk, favorite.pk)
+        self.assertEquals(FavoriteCount.objects.count_for_object(self.dummy), 1)
+
+    def test_post_save(self):
+        """``post_save`` is sent once, when the favorite is created."""
+        received = []
+
+        def receiver(sender, instance, created, **kwargs):
+            received.append((instance.pk, created))
+        models.signals.post_save.connect(receiver, sender=Favorite, dispatch_uid='tests-post-save')
+        try:
+            favorite = Favorite.objects.get_or_create_favorite(self.dummy, self.godzilla)[0]
+            Favorite.objects.get_or_create_favorite(self.dummy, self.godzilla)
+        finally:
+            models.signals.post_save.disconnect(sender=Favorite, dispatch_uid='tests-post-save')
+        self.assertEquals(received, [(favorite.pk, True)])
+
+    def test_savepoint_fallback(self):
+        """Databases without ``INSERT ... ON CONFLICT`` use a savepoint."""
+        Favorite.objects._insert_ignore = lambda favorite: None
+        try:
+            favorite, created = Favorite.objects.get_or_create_favorite(self.dummy, self.godzilla)
+            self.assertTrue(created)
+            again, created = Favorite.objects.get_or_create_favorite(self.dummy, self.godzilla)
+            self.assertFalse(created)
+            self.assertEquals(again.pk, favorite.pk)
+        finally:
+            del Favorite.objects._insert_ignore
+        self.assertEquals(FavoriteCount.objects.count_for_object(self.dummy), 1)
+
+    @skipUnless(connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 24),
+                'INSERT ... ON CONFLICT is checked on SQLite 3.24+')
+    def test_not_null(self):
+        """Only unique constraints are ignored."""
+        favorite = Favorite(user=self.godzilla, object_id=None,
+                            content_type=ContentType.objects.get_for_model(DummyModel))
+        self.assertRaises(IntegrityError, Favorite.objects._insert_ignore, favorite)
+
+    def test_double_post(self):
+        """Posting twice to ``favorite_add`` doesn't fail."""
+        self.client.login(username='godzilla', password='godzilla')
+        url = reverse('favorites:favorite_ajax_add')
+        data = {'content_type_id': ContentType.objects.get_for_model(DummyModel).pk,
+                'object_id': self.dummy.pk}
+        for _ in range(2):
+            response = self.client.post(url, data)
+            self.assertEquals(json.loads(response.content), {'is_favorite': True, 'count': 1})
+
+
+class ConcurrentFavoriteTests(TransactionTestCase):
+    """Creates the same favorite from many threads at once."""
+
+    @skipIf(connection.vendor == 'sqlite' and
+            connection.settings_dict['TEST_NAME'] in (None, '', ':memory:'),
+            'threads do not share in-memory SQLite databases')
+    def test_threads(self):
+        godzilla = User.objects.create(username='godzilla')
+        dummy = DummyModel.objects.create()
+        results = []
+
+        def create():
+            try:
+                results.append(Favorite.objects.get_or_create_favorite(dummy, godzilla)[1])
+            except Exception, e:
+                results.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(sorted(results), [False] * 9 + [True])
+        self.assertEquals(Favorite.objects.favorites_for_object(dummy).count(), 1)
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 1)
+
+
+class ConditionalListTests(BaseFavoritesTestCase):
+    """Tests for conditional requests of list views."""
+
+    def setUp(self):
+        super(ConditionalListTests, self).setUp()
+        self.godzilla = self.user('godzilla')
+        self.dummy = DummyModel.objects.create()
+        Favorite.objects.create_favorite(self.dummy, self.godzilla)
+        self.client.login(username='godzilla', password='godzilla')
+
+    def list_urls(self):
+        folder = Folder.objects.create(user=self.godzilla, name='monsters')
+        kwargs = {'app_label': 'favorites', 'object_name': 'dummymodel'}
+        return [reverse('favorites:favorite_list'),
+                reverse('favorites:folder_list'),
+                reverse('favorites:favorite_content_type_list', kwargs=kwargs),
+                reverse('favorites:favorite_content_type_and_folder_list',
+                        kwargs=dict(kwargs, folder_id=folder.pk))]
+
+    def test_versions(self):
+        """Favorite and folder changes bump user's version."""
+        version = FavoriteVersion.objects.get_for_user(self.godzilla).version
+        folder = Folder.objects.create(user=self.godzilla, name='monsters')
+        favorite = Favorite.objects.favorites_for_user(self.godzilla).get()
+        favorite.move(folder)
+        favorite.delete()
+        Favorite.objects.bulk_create_favorites([self.dummy], self.godzilla)
+        Favorite.objects.bulk_remove_favorites([self.dummy], self.godzilla)
+        Favorite.objects.get_or_create_favorite(self.dummy, self.godzilla)
+        folder.delete()
+        self.assertEquals(FavoriteVersion.objects.get_for_user(self.godzilla).version,
+                          version + 7)
+        self.assertIsNone(FavoriteVersion.objects.get_for_user(self.user('hulk')))
+
+    def test_folder_queryset_delete(self):
+        """Folders deleted with a queryset bump user's version."""
+        Folder.objects.create(user=self.godzilla, name='monsters')
+        version = FavoriteVersion.objects.get_for_user(self.godzilla).version
+        Folder.objects.filter(user=self.godzilla).delete()
+        self.assertEquals(FavoriteVersion.objects.get_for_user(self.godzilla).version,
+                          version + 1)
+
+    def test_not_modified(self):
+        """Unchanged lists are answered with a 304 without listing favorites."""
+        for url in self.list_urls():
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            etag = response['ETag']
+            # session, user and version
+            with self.assertNumQueries(3):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 304)
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEquals(response.status_code, 304)
+
+    def test_modified(self):
+        """Lists are rendered again once favorites changed."""
+        url = reverse('favorites:favorite_list')
+        etag = self.client.get(url)['ETag']
+        Favorite.objects.bulk_remove_favorites([self.dummy], self.godzilla)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+
+
+class FragmentCacheTests(BaseFavoritesTestCase):
+    """Tests for the cached rendering of ``add_remove_favorite``."""
+
+    def setUp(self):
+        get_cache('default').clear()
+
+    def render(self, objects, user):
+        template = Template("{% load favorites_tags %}"
+                            "{% for o in objects %}{% add_remove_favorite o user %}{% endfor %}")
+        return template.render(Context({'objects': objects,
+                                        'user': User.objects.get(pk=user.pk)}))
+
+    def test_script_once(self):
+        """The script is included once, whatever the number of objects."""
+        godzilla = self.user('godzilla')
+        objects = [DummyModel.objects.create(), DummyModel.objects.create()]
+        output = self.render(objects, godzilla)
+        self.assertEquals(output.count('favorites/js/favorites.js'), 1)
+        self.assertNotIn('$.ajax', output)
+
+    def test_single_lookup(self):
+        """Without cache, a link looks up its own favorite only."""
+        godzilla = self.user('godzilla')
+        dummy = DummyModel.objects.create()
+        Favorite.objects.create_favorite(dummy, godzilla)
+        # user, favorite and count
+        with self.assertNumQueries(3):
+            output = self.render([dummy], godzilla)
+        self.assertIn('class="has-favorite"', output)
+
+    def test_cached_render(self):
+        """Cached links are rendered from the caches, without query."""
+        godzilla = self.user('godzilla')
+        objects = [DummyModel.objects.create(), DummyModel.objects.create()]
+        with self.settings(FAVORITES_FRAGMENT_CACHE='default', FAVORITES_CACHE='default'):
+            self.render(objects, godzilla)
+            user = User.objects.get(pk=godzilla.pk)
+            with self.assertNumQueries(0):
+                template = Template("{% load favorites_tags %}"
+                                    "{% for o in objects %}{% add_remove_favorite o user %}{% endfor %}")
+                template.render(Context({'objects': objects, 'user': user}))
+
+    def test_bump_after_write(self):
+        """Versions change once counters are written."""
+        godzilla = self.user('godzilla')
+        dummy = DummyModel.objects.create()
+        counts = []
+        bump_object_versions = favorites.cache.bump_object_versions
+
+        def bump(content_type_id, object_ids):
+            counts.append(FavoriteCount.objects.count_for_object(dummy))
+            bump_object_versions(content_type_id, object_ids)
+        favorites.cache.bump_object_versions = bump
+        try:
+            Favorite.objects.create_favorite(dummy, godzilla).delete()
+        finally:
+            favorites.cache.bump_object_versions = bump_object_versions
+        self.assertEquals(counts, [1, 0])
+
+    def test_invalidation(self):
+        """Links of an object are rendered again when it's favorited."""
+        godzilla, leon = self.user('godzilla'), self.user('leon')
+        dummy = DummyModel.objects.create()
+        with self.settings(FAVORITES_FRAGMENT_CACHE='default'):
+            self.assertIn('>0</span>', self.render([dummy], leon))
+            favorite = Favorite.objects.create_favorite(dummy, godzilla)
+            output = self.render([dummy], leon)
+            self.assertIn('>1</span>', output)
+            self.assertNotIn('has-favorite', output)
+            self.assertIn('class="has-favorite"', self.render([dummy], godzilla))
+            favorite.delete()
+            self.assertIn('>0</span>', self.render([dummy], leon))
+
+
+class AdminTests(BaseFavoritesTestCase):
+    """Tests for the admin of favorites and ``Favorite.__unicode__``."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def changelist(self, **params):
+        response = self.client.get(reverse('admin:favorites_favorite_changelist'), params)
+        self.assertEquals(response.status_code, 200)
+        return response
+
+    def test_changelist_queries(self):
+        """The changelist runs the same queries whatever the number of favorites."""
+        godzilla = self.user('godzilla')
+        folder = Folder.objects.create(user=godzilla, name='foo')
+        for i in range(6):
+            Favorite.objects.create_favorite(DummyModel.objects.create(), godzilla, folder)
+        # session, user, count, favorites with users, content types and
+        # folders, dummy models, content types of the filter
+        with self.assertNumQueries(6):
+            response = self.changelist()
+        self.assertContains(response, 'godzilla likes')
+
+    def test_unicode_without_queries(self):
+        """``__unicode__`` uses ids of the user and object when they aren't loaded."""
+        godzilla = self.user('godzilla')
+        dummy = DummyModel.objects.create()
+        favorite = Favorite.objects.create_favorite(dummy, godzilla)
+        ContentType.objects.get_for_model(DummyModel)
+        favorite = Favorite.objects.get(pk=favorite.pk)
+        with self.assertNumQueries(0):
+            self.assertEquals(unicode(favorite), u'#%s likes dummy model #%s' % (godzilla.pk, dummy.pk))
+        favorite = Favorite.objects.select_related('user').with_content_objects().get(pk=favorite.pk)
+        with self.assertNumQueries(0):
+            self.assertEquals(unicode(favorite), u'godzilla likes %s' % dummy)
+
+    def test_estimated_count(self):
+        """Backends without table statistics count rows."""
+        godzilla = self.user('godzilla')
+        Favorite.objects.create_favorite(DummyModel.objects.create(), godzilla)
+        self.assertEquals(admin.estimated_count(Favorite.objects.all()), 1)
+        self.assertEquals(admin.estimated_count(Favorite.objects.filter(shared=True)), 0)
+
+    def test_filtered_changelist(self):
+        """Filtered changelists estimate the number of favorites, not count them."""
+        godzilla = self.user('godzilla')
+        Favorite.objects.create_favorite(DummyModel.objects.create(), godzilla)
+        estimated = []
+        estimated_count = admin.estimated_count
+
+        def estimate(queryset):
+            estimated.append(bool(queryset.query.where))
+            return estimated_count(queryset)
+        admin.estimated_count = estimate
+        try:
+            response = self.changelist(shared__exact=0)
+        finally:
+            admin.estimated_count = estimated_count
+        self.assertEquals(sorted(estimated), [False, True])
+        self.assertEquals(response.context['cl'].full_result_count, 1)
+
+    def test_delete_selected(self):
+        """The delete action removes favorites from the counters."""
+        godzilla = self.user('godzilla')
+        dummy = DummyModel.objects.create()
+        favorite = Favorite.objects.create_favorite(dummy, godzilla)
+        self.client.post(reverse('admin:favorites_favorite_changelist'),
+                         {'action': 'delete_selected', '_selected_action': [favorite.pk],
+                          'post': 'yes'})
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEquals(FavoriteCount.objects.count_for_object(dummy), 0)
@@ -30,6 +30,27 @@ urlpatterns = patterns("",
                        url(r'^favorite/(?P<favorite_id>\d+)/toggle$',
                            'favorites.views.favorite_toggle_share',
                            name='favorite_toggle_share'),
+                       # ajax
+                       url(r'^favorite/ajax/add$',
+                           'favorites.views.favorite_ajax_add',
+                           name='favorite_ajax_add'),
+                       url(r'^favorite/ajax/remove$',
+                           'favorites.views.favorite_ajax_remove',
+                           name='favorite_ajax_remove'),
+                       url(r'^favorite/toggle/(?P<content_type_id>\d+)/(?P<object_id>\d+)$',
+                           'favorites.views.favorite_toggle',
+                           name='favorite_toggle'),
+                       # shared
+                       url(r'^favorites/shared/$',
+                           'favorites.views.favorite_shared_list',
+                           name='favorite_shared_list'),
+                       url(r'^favorites/shared/(?P<username>[\w.@+-]+)/$',
+                           'favorites.views.favorite_shared_list',
+                           name='favorite_shared_list_for_user'),
+                       # export
+                       url(r'^favorites/export$',
+                           'favorites.views.favorite_export',
+                           name='favorite_export'),
                        # more listing
                        url(r'^favorite/(?P<app_label>\w+)/(?P<object_name>\w+)/$',
                            'favorites.views.favorite_content_type_and_folder_list',
@@ -1,19 +1,89 @@
-from django.db.models import get_model
-from django.contrib.contenttypes.models import ContentType
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
 from django.http import HttpResponseBadRequest
+from django.utils import timezone
+
+from favorites import registry
 
 
 def get_object_or_400_response(app_label, object_name, object_id):
-    """Try to fetch the described object, if it fails, returns a HttpResponse"""
-    model = get_model(app_label, object_name)
+    """Try to fetch the described object, if it fails, returns a HttpResponse.
+
+    The model is resolved with :mod:`favorites.registry`."""
+    options = registry.get_by_name(app_label, object_name)
+    if options is None:  # there no such model
+        return HttpResponseBadRequest()
+    return _get_object_or_400_response(options, object_id)
+
+
+def _get_object_or_400_response(options, object_id):
+    queryset = options.model._base_manager.all()
+    if options.select_related:
+        queryset = queryset.select_related(*options.select_related)
     try:
-        content_type = ContentType.objects.get_for_model(model)
-    except AttributeError: # there no such model
+        return queryset.get(pk=object_id)
+    except (options.model.DoesNotExist, ValueError):  # there no such object
+        return HttpResponseBadRequest()
+
+
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def keyset_page(queryset, cursor=None, per_page=50):
+    """Returns a page of ``queryset`` using keyset pagination on
+    ``(created_on, id)``, most recent first.
+
+    Fetching a page only seeks past the cursor, so any page costs the
+    same as the first one.
+
+    :param cursor: value returned for the previous page, ``None`` for the first page.
+    :returns: a tuple with the list of objects of the page and the cursor of
+              the next page, ``None`` if it's the last page.
+    :raises ValueError: if ``cursor`` is not a valid cursor.
+    """
+    queryset = queryset.order_by('-created_on', '-id')
+    if cursor:
+        created_on, pk = parse_cursor(cursor)
+        # the redundant upper bound lets the planner seek on the index
+        # (user_id, created_on) instead of filtering the OR
+        queryset = queryset.filter(Q(created_on__lt=created_on) |
+                                   Q(created_on=created_on, pk__lt=pk),
+                                   created_on__lte=created_on)
+    objects = list(queryset[:per_page + 1])
+    if len(objects) > per_page:
+        objects = objects[:per_page]
+        last = objects[-1]
+        return objects, format_cursor(last.created_on, last.pk)
+    return objects, None
+
+
+def format_cursor(created_on, pk):
+    """Returns the cursor pointing after the object created on ``created_on`` with ``pk``.
+
+    Aware dates are written in UTC."""
+    if timezone.is_aware(created_on):
+        created_on = created_on.astimezone(timezone.utc)
+    return '%s-%s' % (created_on.strftime(CURSOR_DATE_FORMAT), pk)
+
+
+def parse_cursor(cursor):
+    """Returns the ``(created_on, pk)`` tuple of a cursor, raises ``ValueError``
+    if it's not a valid cursor. The date is in UTC if ``USE_TZ`` is set."""
+    created_on, pk = cursor.split('-')
+    created_on = datetime.strptime(created_on, CURSOR_DATE_FORMAT)
+    if settings.USE_TZ:
+        created_on = timezone.make_aware(created_on, timezone.utc)
+    return created_on, int(pk)
+
+
+def get_object_by_content_type_or_400_response(content_type_id, object_id):
+    """Try to fetch the object described by a content type id, if it fails,
+    returns a HttpResponse.
+
+    The model is resolved with :mod:`favorites.registry`."""
+    options = registry.get_by_content_type_id(content_type_id)
+    if options is None:  # there no such model
         return HttpResponseBadRequest()
-    else:
-        try:
-            instance = content_type.get_object_for_this_type(pk=object_id)
-        except model.DoesNotExist: # there no such object
-            return HttpResponseBadRequest()
-        else:
-            return instance
+    return _get_object_or_400_response(options, object_id)
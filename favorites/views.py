@@ -1,17 +1,22 @@
+import json
 import urlparse
 
 from django.shortcuts import render
 from django.shortcuts import redirect
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.contrib.contenttypes.models import ContentType
-from django.db.models import get_model
+from django.contrib.auth.models import User
+from django.views.decorators.http import condition, require_POST
 from django.http import (HttpResponse, HttpResponseNotFound, HttpResponseBadRequest,
                          HttpResponseForbidden)
 from django.core.urlresolvers import reverse
+from django.conf import settings
+from django.utils.datastructures import SortedDict
 
-from utils import get_object_or_400_response
-from models import Favorite, Folder
+from favorites import export, registry
+from utils import (get_object_or_400_response, get_object_by_content_type_or_400_response,
+                   keyset_page)
+from models import Favorite, FavoriteCount, FavoriteVersion, Folder
 from favorites.forms import (FolderForm, UserFolderChoicesForm, ValidationForm,
                              HiddenFolderForm)
 
@@ -44,16 +49,64 @@ def _get_next(request):
     return next_url
 
 
+def _get_favorites_version(request):
+    """Returns user's :class:`favorites.models.FavoriteVersion`, looked up once
+    per request"""
+    if not hasattr(request, '_favorites_version'):
+        request._favorites_version = FavoriteVersion.objects.get_for_user(request.user)
+    return request._favorites_version
+
+
+def _favorites_etag(request, *args, **kwargs):
+    version = _get_favorites_version(request)
+    if version is not None:
+        return '%s-%s' % (version.user_id, version.version)
+
+
+def _favorites_last_modified(request, *args, **kwargs):
+    version = _get_favorites_version(request)
+    if version is not None:
+        return version.modified_on
+
+
+#: Answers conditional requests with a 304 if user's favorites and folders
+#: didn't change, without calling the view
+favorites_condition = condition(etag_func=_favorites_etag,
+                                last_modified_func=_favorites_last_modified)
+
+
+def _get_folder_choices(user):
+    """Returns a dictionary mapping ids of user's folders, as strings, to the
+    folders, and their choices for :class:`favorites.forms.UserFolderChoicesForm`,
+    with a single query."""
+    folders = Folder.objects.filter(user=user).order_by('name')
+    folders = SortedDict((unicode(folder.pk), folder) for folder in folders)
+    return folders, [(folder.pk, folder.name) for folder in folders.values()]
+
+
+def _get_page(request, queryset):
+    """Returns the page of ``queryset`` pointed by the ``cursor`` GET parameter,
+    see :func:`favorites.utils.keyset_page`."""
+    per_page = getattr(settings, 'FAVORITES_PAGE_SIZE', 50)
+    return keyset_page(queryset, request.GET.get('cursor'), per_page)
+
+
 ### FOLDER VIEWS ###########################################################
 
 @login_required
+@favorites_condition
 def folder_list(request):
-    """Lists user's folders
+    """Lists user's folders with their number of favorites. Answers conditional
+    requests, see :data:`favorites.views.favorites_condition`.
 
     :template favorites/folder_list.html: - ``object_list`` as list of user's folders
+                                          - ``root`` unsaved folder standing for favorites
+                                            without folder
+                                          each folder has ``favorite_count`` and ``last_favorited_on``
+                                          attributes, see :meth:`favorites.managers.FolderManager.with_favorite_counts`.
     """
-    object_list = Folder.objects.filter(user=request.user)
-    ctx = {'object_list': object_list}
+    folders = Folder.objects.with_favorite_counts(request.user)
+    ctx = {'object_list': folders[1:], 'root': folders[0]}
     return render(request, 'favorites/folder_list.html', ctx)
 
 
@@ -133,12 +186,22 @@ def folder_delete(request, object_id):
 
 
 @login_required
+@favorites_condition
 def favorite_list(request):
-    """Lists user's favorites
+    """Lists user's favorites, most recent first, ``FAVORITES_PAGE_SIZE`` at a time.
+    Returns a 400 if the ``cursor`` GET parameter is invalid. Answers conditional
+    requests, see :data:`favorites.views.favorites_condition`.
 
-    :template favorites/favorite_list.html: - ``favorites`` list of user's :class:`favorites.models.Favorite`."""
+    :template favorites/favorite_list.html: - ``favorites`` list of user's :class:`favorites.models.Favorite`.
+                                            - ``next_cursor`` value of the ``cursor`` GET parameter
+                                              for the next page, ``None`` on the last page."""
     object_list = Favorite.objects.favorites_for_user(request.user)
-    ctx = {'favorites': object_list}
+    object_list = object_list.select_related('user', 'folder').with_content_objects()
+    try:
+        object_list, next_cursor = _get_page(request, object_list)
+    except ValueError:
+        return HttpResponseBadRequest()
+    ctx = {'favorites': object_list, 'next_cursor': next_cursor}
     return render(request, 'favorites/favorite_list.html', ctx)
 
 
@@ -170,36 +233,29 @@ def favorite_add(request, app_label, object_name, object_id):  #FIXME factor
     if isinstance(instance_or_response, HttpResponse):
         return instance_or_response  # the object is not found can be unknown
                                      # model or unknown object
-    else:
-        # it's a known object
-        instance = instance_or_response
-        favorites = Favorite.objects.favorites_for_object(instance, request.user)
+    instance = instance_or_response
+    if request.method == 'POST':
+        folders, folder_choices = _get_folder_choices(request.user)
+        form = UserFolderChoicesForm(choices=folder_choices, data=request.POST)
+        if form.is_valid():
+            # form is valid hence the folder exists and is owned by the user
+            folder = folders.get(form.cleaned_data['folder_id'])
+            # creating the favorite also checks that it's not already favorited
+            favorite, created = Favorite.objects.get_or_create_favorite(instance, request.user, folder)
+            if created:
+                return redirect(_get_next(request))
+            ctx = {'object': instance, 'next': _get_next(request), 'favorite': favorite}
+            return render(request, 'favorites/favorite_already_favorite.html', ctx)
+    else:  # GET
         # is it already favorited by the user
+        favorites = list(Favorite.objects.favorites_for_object(instance, request.user)[:1])
         if favorites:
-            # user already has this object as favorite
-            favorite = favorites[0]
-            ctx = {'object': instance, 'next': _get_next(request), 'favorite': favorite}
+            ctx = {'object': instance, 'next': _get_next(request), 'favorite': favorites[0]}
             return render(request, 'favorites/favorite_already_favorite.html', ctx)
-        else:
-            # init folder_choices for UserFolderChoicesForm validation or rendering
-            query = Folder.objects.filter(user=request.user)
-            folder_choices = query.order_by('name').values_list('pk', 'name')
-            if request.method == 'POST':
-                form = UserFolderChoicesForm(choices=folder_choices, data=request.POST)
-                if form.is_valid():
-                    folder_id = form.cleaned_data['folder_id']
-                    if folder_id:
-                        # form is valid hence the folder exists
-                        folder = Folder.objects.get(pk=folder_id)
-                    else:
-                        folder = None
-                    Favorite.objects.create_favorite(instance, request.user, folder)
-                    return redirect(_get_next(request))
-            else:  # GET
-                form = UserFolderChoicesForm(choices=folder_choices)
-            # if form is not valid or if it's a GET request
-            ctx = {'form': form, 'object': instance, 'next':_get_next(request)}
-            return render(request, 'favorites/favorite_add.html', ctx)
+        form = UserFolderChoicesForm(choices=_get_folder_choices(request.user)[1])
+    # if form is not valid or if it's a GET request
+    ctx = {'form': form, 'object': instance, 'next':_get_next(request)}
+    return render(request, 'favorites/favorite_add.html', ctx)
 
 
 ### DELETE
@@ -269,24 +325,22 @@ def favorite_move(request, object_id):
                                             - ``next`` value returned by :func:`favorites.views._get_next`.
                                             - ``form`` :class:`favorites.forms.UserFolderChoicesForm` instance.
     """
-    favorite = get_object_or_404(Favorite, pk=object_id)
+    # the page shows the user and favorited object
+    query = Favorite.objects.select_related('user').with_content_objects()
+    favorite = get_object_or_404(query, pk=object_id)
     # check credentials
     if not favorite.user == request.user:
         return HttpResponseForbidden()
     else:
         # init folder choices for form
-        folder_choices = Folder.objects.filter(user=request.user).order_by('name').values_list('pk', 'name')
+        folders, folder_choices = _get_folder_choices(request.user)
 
         if request.method == 'POST':
             form = UserFolderChoicesForm(choices=folder_choices, data=request.POST)
             if form.is_valid():
-                folder_id = form.cleaned_data['folder_id']
-                if folder_id == '':
-                    folder = None
-                else:
-                    folder = get_object_or_404(Folder, pk=folder_id)
-                favorite.folder = folder
-                favorite.save()
+                # no folder if folder_id is empty
+                folder = folders.get(form.cleaned_data['folder_id'])
+                favorite.move(folder)
                 return redirect(_get_next(request))
         else:
             folder_id = favorite.folder.pk if favorite.folder else ''
@@ -345,8 +399,7 @@ def favorite_toggle_share(request, favorite_id):
         if request.method == 'POST':
             form = ValidationForm(data=request.POST)
             if form.is_valid():
-                favorite.shared = False if favorite.shared else True  # toggle
-                favorite.save()
+                favorite.toggle_share()
                 return redirect(_get_next(request))
         else:
             form = ValidationForm()
@@ -356,28 +409,31 @@ def favorite_toggle_share(request, favorite_id):
 
 
 @login_required
+@favorites_condition
 def favorite_content_type_and_folder_list(request, app_label, object_name, folder_id=None):
     """
-    Retrieve favorites for a user by content_type.
+    Retrieve favorites for a user by content_type, most recent first,
+    ``FAVORITES_PAGE_SIZE`` at a time.
 
     The optional folder_id parameter will be used to filter the favorites, if
-    passed.
+    passed. Answers conditional requests, see :data:`favorites.views.favorites_condition`.
 
     :template favorites/favorite_content_type_list.html: - ``app_label`` Generic Foreign Key parameter.
                                                          - ``object_name`` Generic Foreign Key parameter.
 
                                                          - ``favorites`` :class:`favorites.models.Favorites`
+                                                         - ``next_cursor`` value of the ``cursor`` GET parameter
+                                                           for the next page, ``None`` on the last page.
 
     :template favorites/favorite_{{app_label}}_{{object_name}}_list.html: same as above
 
     :template favorites/favorite_{{app_label}}_{{object_name}}_by_folder_list.html: - same as above and
                                                                                     - ``folder`` :class:`favorites.models.Folder` instance."""
-    model = get_model(app_label, object_name)
-    if model is None:
+    options = registry.get_by_name(app_label, object_name)
+    if options is None:
         return HttpResponseBadRequest()
-    content_type = ContentType.objects.get_for_model(model)
 
-    filters = {"content_type":content_type, "user":request.user}
+    filters = {"content_type": options.content_type_id, "user": request.user}
     templates = []
     context_data = {
         'app_label': app_label,
@@ -395,8 +451,13 @@ def favorite_content_type_and_folder_list(request, app_label, object_name, folde
                                                       % (app_label, object_name)
         templates.append(dynamic_template)
 
-    favorites = Favorite.objects.filter(**filters)
+    try:
+        favorites = Favorite.objects.filter(**filters).select_related('user')
+        favorites, next_cursor = _get_page(request, favorites.with_content_objects())
+    except ValueError:
+        return HttpResponseBadRequest()
     context_data["favorites"] = favorites
+    context_data["next_cursor"] = next_cursor
 
     # Set content_type specific and default templates
     dynamic_template = 'favorites/favorite_%s_%s_list.html' % (app_label,
@@ -405,3 +466,119 @@ def favorite_content_type_and_folder_list(request, app_label, object_name, folde
     # Default
     templates.append('favorites/favorite_content_type_list.html')
     return render(request, templates, context_data)
+
+
+### SHARED
+
+
+def favorite_shared_list(request, username=None):
+    """Lists shared favorites of the user named ``username``, or of every
+    user, most recent first, ``FAVORITES_PAGE_SIZE`` at a time. It doesn't
+    require to be logged in. Returns a 400 if the ``cursor`` GET parameter
+    is invalid.
+
+    :template favorites/favorite_shared_list.html: - ``favorites`` list of shared :class:`favorites.models.Favorite`.
+                                                   - ``owner`` user named ``username`` or ``None``.
+                                                   - ``next_cursor`` value of the ``cursor`` GET parameter
+                                                     for the next page, ``None`` on the last page."""
+    if username is None:
+        owner = None
+        object_list = Favorite.objects.recent_shared()
+    else:
+        owner = get_object_or_404(User, username=username)
+        object_list = Favorite.objects.shared_for_user(owner)
+    object_list = object_list.select_related('user').with_content_objects()
+    try:
+        object_list, next_cursor = _get_page(request, object_list)
+    except ValueError:
+        return HttpResponseBadRequest()
+    ctx = {'favorites': object_list, 'owner': owner, 'next_cursor': next_cursor}
+    return render(request, 'favorites/favorite_shared_list.html', ctx)
+
+
+### AJAX
+
+
+def _favorite_state_response(instance, is_favorite):
+    """Returns a JSON response with the favorite state of ``instance`` for
+    current user and its favorites count."""
+    data = {'is_favorite': is_favorite,
+            'count': FavoriteCount.objects.count_for_object(instance)}
+    return HttpResponse(json.dumps(data), content_type='application/json')
+
+
+@login_required
+@require_POST
+def favorite_ajax_add(request):
+    """Adds the object described by ``content_type_id`` and ``object_id`` POST
+    parameters to user's favorites. It returns a 400 if there is no such object.
+
+    Returns ``{"is_favorite": true, "count": <favorites count of the object>}`` as JSON."""
+    instance_or_response = get_object_by_content_type_or_400_response(request.POST.get('content_type_id'),
+                                                                      request.POST.get('object_id'))
+    if isinstance(instance_or_response, HttpResponse):
+        return instance_or_response
+    instance = instance_or_response
+    Favorite.objects.get_or_create_favorite(instance, request.user)
+    return _favorite_state_response(instance, True)
+
+
+@login_required
+@require_POST
+def favorite_ajax_remove(request):
+    """Removes the object described by ``content_type_id`` and ``object_id`` POST
+    parameters from user's favorites. It returns a 400 if there is no such object.
+
+    Returns ``{"is_favorite": false, "count": <favorites count of the object>}`` as JSON."""
+    instance_or_response = get_object_by_content_type_or_400_response(request.POST.get('content_type_id'),
+                                                                      request.POST.get('object_id'))
+    if isinstance(instance_or_response, HttpResponse):
+        return instance_or_response
+    instance = instance_or_response
+    Favorite.objects.bulk_remove_favorites([instance], request.user)
+    return _favorite_state_response(instance, False)
+
+
+@login_required
+def favorite_toggle(request, content_type_id, object_id):
+    """Toggles the favorite state of the object for current user. It returns
+    a 400 if there is no such object.
+
+    If it's a `POST` returns ``{"is_favorite": <new state>, "count": <favorites count
+    of the object>}`` as JSON, otherwise redirects to :func:`favorites.views.favorite_add`
+    or :func:`favorites.views.favorite_delete_for_object` confirmation."""
+    instance_or_response = get_object_by_content_type_or_400_response(content_type_id, object_id)
+    if isinstance(instance_or_response, HttpResponse):
+        return instance_or_response
+    instance = instance_or_response
+    if request.method == 'POST':
+        is_favorite = not Favorite.objects.bulk_remove_favorites([instance], request.user)
+        if is_favorite:
+            Favorite.objects.get_or_create_favorite(instance, request.user)
+        return _favorite_state_response(instance, is_favorite)
+    else:
+        if Favorite.objects.favorites_for_object(instance, request.user).exists():
+            view_name = 'favorites:favorite_delete_for_object'
+        else:
+            view_name = 'favorites:favorite_add'
+        kwargs = {'app_label': instance._meta.app_label,
+                  'object_name': instance._meta.module_name,
+                  'object_id': instance.pk}
+        return redirect('%s?next=%s' % (reverse(view_name, kwargs=kwargs), _get_next(request)))
+
+
+### EXPORT
+
+
+@login_required
+def favorite_export(request):
+    """Streams user's favorites as an attachment in the format given by the
+    ``format`` GET parameter, ``ndjson`` (default) or ``csv``, see
+    :mod:`favorites.export`. Returns a 400 if the format is unknown."""
+    format = request.GET.get('format', 'ndjson')
+    if format not in export.FORMATS:
+        return HttpResponseBadRequest()
+    response = HttpResponse(export.export(request.user, format),
+                            content_type=export.FORMATS[format])
+    response['Content-Disposition'] = 'attachment; filename=favorites.%s' % format
+    return response
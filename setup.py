@@ -3,6 +3,8 @@ import os
 
 
 modules = [
+    'favorites.management',
+    'favorites.management.commands',
     'favorites.templatetags',
     'favorites.templates.favorites',
 ]
@@ -18,7 +20,8 @@ setup(
     include_package_data=True,
     package_data = {
            '': ['*.txt', '*.rst'],
-           'favorites': ['templates/favorites/*.html'],
+           'favorites': ['templates/favorites/*.html', 'static/favorites/js/*.js', 'sql/*.sql',
+                         'benchmark_baselines.json'],
        },
 
     classifiers = ['Development Status :: 4 - Beta',